@@ -1,21 +1,27 @@
+import heapq
 import os
 import sys
-from typing import List, Union
+from typing import List, Optional, Union
+
+import numpy as np
+from scipy.spatial import cKDTree
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 parent_dir_path = os.path.abspath(os.path.join(dir_path, os.pardir))
 sys.path.insert(0, parent_dir_path)
 from entity.single_cluster import SingleCluster
 from entity.multi_cluster import MultiCluster
-from utils import inner_product, util
+from utils import inner_product, path_solver, util
+from utils.job_pipeline import MAX_IN_FLIGHT
 
 
 class HierarchicalTree:
     def __init__(self, clusters: List[Union[SingleCluster, MultiCluster]], cluster_num: int, stop_threshold: int,
                  x_range: List[float], y_range: List[float], max_qubit_num: int, env: str, backend: str,
-                 print_detail: bool = False):
+                 print_detail: bool = False, solver: str = 'held_karp', inner_product_mode: str = 'circuit',
+                 max_in_flight: int = MAX_IN_FLIGHT, memoize: bool = True, seed=None):
         """
-        :param clusters: list, the input of QAHCA
+        :param clusters: list, the input of QAHCA, which is shared with the caller and always updated in place
         :param cluster_num: int, the number of clusters
         :param stop_threshold: int, the final number of clusters to stop QAHCA
         :param x_range: list, the range of x-axis values of all centroids
@@ -24,6 +30,12 @@ class HierarchicalTree:
         :param env: string, the environment type for implementing the circuit
         :param backend: string, the backend name when running the circuit on real quantum devices
         :param print_detail: boolean, whether to print the execution detail
+        :param solver: string, the exact path solver used by MultiClusters: held_karp or branch_and_bound
+        :param inner_product_mode: string, how swap tests are evaluated: circuit, analytic or sampled
+        :param max_in_flight: int, the maximum number of unfinished swap-test jobs
+        :param memoize: boolean, whether the similarities of centroid pairs are looked up in the shared
+                        inner_product.similarity_cache before being evaluated
+        :param seed: int or numpy Generator, the source of shot noise when swap tests are sampled
         """
         self.clusters = clusters
         self.cluster_num = cluster_num
@@ -32,12 +44,24 @@ class HierarchicalTree:
         self.x_range = x_range
         self.y_range = y_range
         self.range = max(self.x_range[1] - self.x_range[0], self.y_range[1] - self.y_range[0])
-        self.cost_adj = [[0 for _ in range(self.cluster_num)] for _ in range(self.cluster_num)]
+        # the symmetric similarities between clusters, the clusters keep their initial positions while building the tree
+        self.cost_adj = np.zeros((self.cluster_num, self.cluster_num))
+        # whether the cluster in each position has not been merged into another one
+        self.is_active = np.ones(self.cluster_num, dtype=bool)
+        # bumped when the cluster in the position absorbs another one, which invalidates its entries in merge_heap
+        self.versions = np.zeros(self.cluster_num, dtype=np.int64)
+        # the max-heap of (-cost, i, j, version of i, version of j) for i < j, whose stale entries are skipped lazily
+        self.merge_heap = []
         self.max_qubit_num = max_qubit_num
 
         self.env = env
         self.backend = backend
         self.print_detail = print_detail
+        self.solver = solver
+        self.inner_product_mode = inner_product_mode
+        self.max_in_flight = max_in_flight
+        self.memoize = memoize
+        self.rng = np.random.default_rng(seed)
 
         self.initialization()
 
@@ -52,175 +76,147 @@ class HierarchicalTree:
             self.norm_cents[i] = inner_product.normalization(self.clusters[i].centroid, self.x_range[0],
                                                              self.y_range[0], self.range)
 
-    def calculate_cost(self):
+    def cal_similarities(self, vec_list_1, vec_list_2) -> list:
+        """
+        estimating the similarities between pairs of normalized centroids by swap tests
+        """
         task_num_per_circuit = self.max_qubit_num // 3
+        cal_inner_products = inner_product.cal_memoized_inner_products if self.memoize else \
+            inner_product.cal_inner_products
+        return cal_inner_products(vec_list_1, vec_list_2, task_num_per_circuit, self.env, self.backend,
+                                  self.print_detail, self.inner_product_mode, self.max_in_flight, rng=self.rng)
 
-        vec_list_1 = []
-        vec_list_2 = []
-        jobs = []
-        cur_cal_num = task_num_per_circuit
-        outputs = []
-        for cent_1, i in enumerate(self.norm_cents):
-            for cent_2, j in enumerate(self.norm_cents):
-                if i >= j:
-                    continue
-
-                vec_list_1.append(cent_1)
-                vec_list_2.append(cent_2)
-                cur_cal_num -= 1
-
-                if cur_cal_num <= 0:
-                    cur_cal_num = task_num_per_circuit
-                    jobs.append(inner_product.cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, self.env,
-                                                                self.backend, self.print_detail))
-
-                    vec_list_1.clear()
-                    vec_list_2.clear()
-
-                    if len(jobs) >= 3:
-                        for job in jobs:
-                            outputs.append(inner_product.get_inner_product_result(job, task_num_per_circuit,
-                                                                                  self.env))
-
-                        jobs.clear()
-
-        if vec_list_1:
-            jobs.append(inner_product.cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit,
-                                                        self.env, self.backend, self.print_detail))
-        for job in jobs:
-            outputs.append(inner_product.get_inner_product_result(job, task_num_per_circuit, self.env))
-
-        index = 0
-        for i in range(self.cluster_num):
-            for j in range(i + 1, self.cluster_num):
-                self.cost_adj[i][j] = outputs[index]
-                index += 1
+    def calculate_cost(self):
+        rows, cols = np.triu_indices(self.cluster_num, 1)
+        vec_list_1 = [self.norm_cents[i] for i in rows]
+        vec_list_2 = [self.norm_cents[j] for j in cols]
 
-    def find_maximum(self):
-        max_i, max_j, max_val = 0, 0, 0
-        for i in range(self.cluster_num):
-            for j in range(i + 1, self.cluster_num):
-                if self.cost_adj[i][j] > max_val:
-                    max_val = self.cost_adj[i][j]
-                    max_i = i
-                    max_j = j
+        outputs = self.cal_similarities(vec_list_1, vec_list_2)
+
+        self.cost_adj[rows, cols] = outputs
+        self.cost_adj[cols, rows] = outputs
+        self.merge_heap = [(-cost, i, j, 0, 0) for cost, i, j in zip(outputs, rows.tolist(), cols.tolist())]
+        heapq.heapify(self.merge_heap)
 
-        return max_i, max_j
+    def find_maximum(self):
+        """
+        finding the pair of active clusters with the maximum cost, the ties are broken by the smaller positions
+        :return: the positions of the pair
+        """
+        while self.merge_heap:
+            _, i, j, version_i, version_j = heapq.heappop(self.merge_heap)
+            if self.is_active[i] and self.is_active[j] and self.versions[i] == version_i and \
+                    self.versions[j] == version_j:
+                return i, j
+        raise ValueError("There are no clusters to merge")
 
     def update_info(self, max_i, max_j):
-        # updating the size of cost matrix
-        new_cost_adj = [[0 for _ in range(self.cluster_num - 1)] for _ in range(self.cluster_num - 1)]
-        for i in range(max_j):
-            for j in range(i + 1, self.cluster_num):
-                if j == max_j:
-                    continue
-                elif j < max_j:
-                    new_cost_adj[i][j] = self.cost_adj[i][j]
-                else:
-                    new_cost_adj[i][j - 1] = self.cost_adj[i][j]
-
-        for i in range(max_j + 1, self.cluster_num):
-            for j in range(i + 1, self.cluster_num):
-                new_cost_adj[i - 1][j - 1] = self.cost_adj[i][j]
-
-        self.cost_adj = new_cost_adj
+        """
+        updating the costs after the max_j-th cluster is merged into the max_i-th cluster, only the costs of
+        the max_i-th cluster are recalculated
+        """
+        self.is_active[max_j] = False
+        self.versions[max_i] += 1
         self.cluster_num -= 1
 
         # updating the cost between max_i-th cluster and other clusters
         self.norm_cents[max_i] = inner_product.normalization(self.clusters[max_i].centroid, self.x_range[0],
                                                              self.y_range[0], self.range)
-        self.norm_cents.pop(max_j)
 
-        vec_list_1 = []
-        vec_list_2 = []
-        task_num_per_circuit = self.max_qubit_num // 3
-        cur_cal_num = task_num_per_circuit
-        jobs = []
-        outputs = []
-        for i in range(self.cluster_num):
-            if i == max_i:
-                continue
-
-            vec_list_1.append(self.clusters[max_i])
-            vec_list_2.append(self.clusters[i])
-            cur_cal_num -= 1
-
-            if cur_cal_num <= 0:
-                cur_cal_num = task_num_per_circuit
-                jobs.append(inner_product.cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, self.env,
-                                                            self.backend, self.print_detail))
-                vec_list_1.clear()
-                vec_list_2.clear()
-
-                if len(jobs) >= 3:
-                    for job in jobs:
-                        outputs.append(inner_product.get_inner_product_result(job, task_num_per_circuit, self.env))
-
-                    jobs.clear()
-
-        if vec_list_1:
-            jobs.append(inner_product.cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, self.env,
-                                                        self.backend, self.print_detail))
-        for job in jobs:
-            outputs.append(inner_product.get_inner_product_result(job, task_num_per_circuit, self.env))
-
-        index = 0
-        for i in range(max_i):
-            self.cost_adj[i][max_i] = outputs[index]
-            index += 1
-        for i in range(max_i + 1, self.cluster_num):
-            self.cost_adj[max_i][i] = outputs[index]
-            index += 1
+        others = np.flatnonzero(self.is_active)
+        others = others[others != max_i]
+        vec_list_1 = [self.norm_cents[max_i] for _ in others]
+        vec_list_2 = [self.norm_cents[i] for i in others]
+
+        outputs = self.cal_similarities(vec_list_1, vec_list_2)
+
+        self.cost_adj[max_i, others] = outputs
+        self.cost_adj[others, max_i] = outputs
+        for cost, i in zip(outputs, others.tolist()):
+            low, high = min(i, max_i), max(i, max_i)
+            heapq.heappush(self.merge_heap, (-cost, low, high, int(self.versions[low]), int(self.versions[high])))
+
+    def compact(self):
+        """
+        removing the merged clusters
+        """
+        active = np.flatnonzero(self.is_active)
+        self.clusters[:] = [self.clusters[i] for i in active]
+        self.norm_cents = [self.norm_cents[i] for i in active]
+        self.cost_adj = self.cost_adj[np.ix_(active, active)]
+        self.is_active = np.ones(len(active), dtype=bool)
+        self.versions = np.zeros(len(active), dtype=np.int64)
+        rows, cols = np.triu_indices(len(active), 1)
+        self.merge_heap = [(-cost, i, j, 0, 0) for cost, i, j in
+                           zip(self.cost_adj[rows, cols].tolist(), rows.tolist(), cols.tolist())]
+        heapq.heapify(self.merge_heap)
 
     def build_tree(self):
         while self.cluster_num > self.stop_threshold:
             max_i, max_j = self.find_maximum()
 
             self.clusters[max_i] = MultiCluster(None, [self.clusters[max_i], self.clusters[max_j]], self.env,
-                                                self.backend, self.print_detail)
+                                                self.backend, self.print_detail, self.solver)
             self.clusters[max_i].cal_centroid()
-            self.clusters.pop(max_j)
 
             self.update_info(max_i, max_j)
+        self.compact()
 
-    def decompose_tree(self):
-        is_terminal = False
-        while not is_terminal:
-            is_terminal = True
-            for i in range(len(self.clusters) - 1, -1, -1):
-                if self.clusters[i].class_type == 'Multi':
-                    is_terminal = False
-                    # decomposing this MultiCluster
-                    tmp_multi_cluster = MultiCluster(None, [self.clusters[i - 1], *self.clusters[i].elements,
-                                                            self.clusters[(i + 1) % len(self.clusters)]], self.env,
-                                                     self.backend, self.print_detail)
-                    tmp_multi_cluster.find_optimal_path(self.max_qubit_num)
-                    self.clusters[i: i + 1] = tmp_multi_cluster.elements[1: -1]
+    def decompose_tree(self, clusters: Optional[list] = None):
+        """
+        expanding the MultiClusters level by level until only SingleClusters are left, the elements of each
+        MultiCluster are ordered between its two neighbors on the route
+        :param clusters: list, the top-level clusters in the order of route, self.clusters by default,
+                         which is updated in place
+        """
+        if clusters is not None:
+            self.clusters = clusters
+        while True:
+            cluster_num = len(self.clusters)
+            multi_index = [i for i, cluster in enumerate(self.clusters) if cluster.class_type == 'Multi']
+            if not multi_index:
+                break
+            subproblems = [[self.clusters[i - 1], *self.clusters[i].elements, self.clusters[(i + 1) % cluster_num]]
+                           for i in multi_index]
+            # the subproblems are checked before any of them is solved
+            for subproblem in subproblems:
+                path_solver.check_size(len(subproblem), self.solver)
+
+            expansions = {}
+            for i, subproblem in zip(multi_index, subproblems):
+                opt_path, _ = path_solver.solve(util.cal_dist_matrix([cluster.centroid for cluster in subproblem]),
+                                                self.solver)
+                expansions[i] = [subproblem[j] for j in opt_path[1: -1]]
+            self.clusters[:] = [element for i, cluster in enumerate(self.clusters)
+                                for element in expansions.get(i, [cluster])]
 
     def classical_build_tree(self):
-        # merging nearest neighbor clusters
-        while len(self.clusters) > self.stop_threshold:
-            neighbors = [0 for _ in range(len(self.clusters))]
-            for i in range(len(self.clusters)):
-                min_len = float('inf')
-                min_neighbor = -1
-                for j in range(len(self.clusters)):
-                    if i == j:
-                        continue
-                    cur_len = util.cal_similarity(self.clusters[i].centroid, self.clusters[j].centroid)
-                    if cur_len < min_len:
-                        min_len = cur_len
-                        min_neighbor = j
-                neighbors[i] = min_neighbor
+        """
+        merging the mutual nearest neighbor clusters round by round, the nearest neighbors of all clusters are
+        found at once by a KD-tree of centroids, and only the centroids of merged clusters are updated
+        """
+        centroids = np.array([cluster.centroid for cluster in self.clusters], dtype=np.float64).reshape(-1, 2)
+        while len(self.clusters) > max(self.stop_threshold, 1):
+            positions = np.arange(len(self.clusters))
+            dists, indices = cKDTree(centroids).query(centroids, k=2)
+            # the nearest centroid of a centroid is itself unless another centroid coincides with it
+            is_self = indices[:, 0] == positions
+            neighbors = np.where(is_self, indices[:, 1], indices[:, 0])
             # 判断是否有可以合并的聚类
-            delete_index = []
-            for i in range(len(self.clusters)):
-                for j in range(i + 1, len(self.clusters)):
-                    if neighbors[i] == j and neighbors[j] == i:
-                        self.clusters[i] = MultiCluster(None, [self.clusters[i], self.clusters[j]], self.env,
-                                                        self.backend, self.print_detail)
-                        self.clusters[i].cal_centroid()
-                        delete_index.append(j)
-            delete_index.sort(reverse=True)
-            for i in range(len(delete_index)):
-                self.clusters.pop(delete_index[i])
+            is_first = (neighbors[neighbors] == positions) & (positions < neighbors)
+            if not is_first.any():
+                # the coincident centroids may point to each other in a cycle, the closest pair is merged instead
+                i = int(np.where(is_self, dists[:, 1], dists[:, 0]).argmin())
+                i, j = min(i, neighbors[i]), max(i, neighbors[i])
+                neighbors[i] = j
+                is_first[i] = True
+
+            for i in np.flatnonzero(is_first):
+                self.clusters[i] = MultiCluster(None, [self.clusters[i], self.clusters[neighbors[i]]], self.env,
+                                                self.backend, self.print_detail, self.solver)
+                self.clusters[i].cal_centroid()
+                centroids[i] = self.clusters[i].centroid
+            is_kept = np.ones(len(self.clusters), dtype=bool)
+            is_kept[neighbors[is_first]] = False
+            self.clusters[:] = [cluster for cluster, kept in zip(self.clusters, is_kept) if kept]
+            centroids = centroids[is_kept]
@@ -15,19 +15,76 @@ from utils import inner_product, read_dataset
 from dataset import test
 
 
+def cross(origin, ends_1, ends_2) -> np.ndarray:
+    """
+    the z-component of the cross products of (ends_1 - origin) and (ends_2 - origin), which is positive when
+    the turn from ends_1 to ends_2 is counterclockwise
+    """
+    return ((ends_1[..., 0] - origin[..., 0]) * (ends_2[..., 1] - origin[..., 1]) -
+            (ends_1[..., 1] - origin[..., 1]) * (ends_2[..., 0] - origin[..., 0]))
+
+
+def monotone_chain(points) -> np.ndarray:
+    """
+    finding the convex hull by Andrew's monotone chain, the points strictly inside the quadrilateral of the extreme
+    points are discarded at once before the chains are built over the remaining points sorted by coordinates
+    :param points: list or numpy array with the shape of (n, 2), coordinates of the points in cluster
+    :return: the indices of hull vertices in counterclockwise order, the points in the middle of hull edges are excluded
+    """
+    coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(coords) < 3:
+        return np.arange(len(coords))
+
+    # the leftmost, lowest, rightmost and highest points in counterclockwise order
+    quad = coords[[coords[:, 0].argmin(), coords[:, 1].argmin(), coords[:, 0].argmax(), coords[:, 1].argmax()]]
+    is_inside = np.ones(len(coords), dtype=bool)
+    for k in range(4):
+        is_inside &= cross(quad[k - 1], quad[k], coords) > 0
+    candidates = np.flatnonzero(~is_inside)
+    candidates = candidates[np.lexsort((coords[candidates, 1], coords[candidates, 0]))]
+
+    xs, ys = coords[:, 0].tolist(), coords[:, 1].tolist()
+
+    def build_chain(order) -> list:
+        chain = []
+        for i in order:
+            while len(chain) >= 2 and ((xs[chain[-1]] - xs[chain[-2]]) * (ys[i] - ys[chain[-2]]) -
+                                       (ys[chain[-1]] - ys[chain[-2]]) * (xs[i] - xs[chain[-2]])) <= 0:
+                chain.pop()
+            chain.append(i)
+        return chain
+
+    candidates = candidates.tolist()
+    lower = build_chain(candidates)
+    upper = build_chain(reversed(candidates))
+    return np.array(lower[:-1] + upper[:-1], dtype=np.int64)
+
+
 class ConvexHull:
-    def __init__(self, points, env, backend, print_detail=False):
+    def __init__(self, points, env, backend, print_detail=False, inner_product_mode='circuit', max_qubit_num=None):
+        """
+        :param points: list, coordinates of the points in cluster
+        :param inner_product_mode: string, how swap tests are evaluated: circuit, analytic or sampled
+        :param max_qubit_num: int, maximum number of available qubits, the candidates of each step are split into
+                              circuits of max_qubit_num // 3 swap tests and submitted as one job,
+                              all candidates are compared in one circuit by default
+        """
         self.points = points
+        self.coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
         self.start = None
         self.base_vec = [1, 0]
         self.base_index = None
 
         self.init_start()
         self.convex_hull_set = [self.start]
+        # the indices of hull vertices in points
+        self.convex_hull_index = [self.base_index]
 
         self.env = env
         self.backend = backend
         self.print_detail = print_detail
+        self.inner_product_mode = inner_product_mode
+        self.max_qubit_num = max_qubit_num
 
     def init_start(self):
         # finding the point with minimum y
@@ -44,32 +101,54 @@ class ConvexHull:
         normalized_vec = np.array(vec)
         return normalized_vec / np.linalg.norm(normalized_vec)
 
+    def get_candidate_vecs(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        encoding the directions from the current boundary point to all other points, each direction is halved with
+        the base vector so that the angles in [0, 2pi) are mapped into [0, pi) and keep their order
+        :return: the indices of candidates in points and their normalized vectors
+        """
+        cur = self.coords[self.base_index]
+        base_vec = np.asarray(self.base_vec, dtype=np.float64)
+        # the previous boundary point and the points right behind the base vector are the worst candidates
+        worst_vec = np.array([-base_vec[1], base_vec[0]])
+
+        candidate_index = np.flatnonzero((self.coords != cur).any(axis=1))
+        vecs = self.coords[candidate_index] - cur
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = (vecs + base_vec) / 2
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        is_worst = norms[:, 0] == 0
+        if len(self.convex_hull_set) >= 2:
+            is_worst |= (self.coords[candidate_index] == self.coords[self.convex_hull_index[-2]]).all(axis=1)
+        vecs = np.divide(vecs, norms, out=np.zeros_like(vecs), where=norms > 0)
+        vecs[is_worst] = worst_vec
+        return candidate_index, vecs
+
     def find_convex_hull(self):
         while self.start != self.convex_hull_set[-1] or len(self.convex_hull_set) == 1:
             # finding a new boundary point
-            cur_vec_list = list()
-            for point in self.points:
-                if point != self.convex_hull_set[-1]:
-                    if len(self.convex_hull_set) >= 2 and point == self.convex_hull_set[-2]:
-                        cur_vec_list.append([-self.base_vec[1], self.base_vec[0]])
-                    else:
-                        normalize_vec = self.normalization(np.array(point) - np.array(self.convex_hull_set[-1]))
-                        normalize_vec = (normalize_vec + self.base_vec) / 2
-                        normalize_vec = self.normalization(normalize_vec)
-                        cur_vec_list.append(normalize_vec)
-
-            job = inner_product.cal_inner_product([self.base_vec], cur_vec_list,
-                                                  len(cur_vec_list), self.env, self.backend, False)
-            output = inner_product.get_inner_product_result(job, len(cur_vec_list), self.env)
-            next_hull_index = output.index(max(output))
+            candidate_index, cur_vec_list = self.get_candidate_vecs()
+            task_num_per_circuit = len(cur_vec_list) if self.max_qubit_num is None else self.max_qubit_num // 3
+
+            # every candidate is compared with the current base vector, all comparisons of a step are in one job
+            job = inner_product.cal_inner_product_batch([self.base_vec for _ in cur_vec_list], cur_vec_list,
+                                                        task_num_per_circuit, self.env, self.backend, False,
+                                                        mode=self.inner_product_mode)
+            output = np.array(inner_product.get_inner_product_batch_result(job, task_num_per_circuit, self.env),
+                              dtype=np.float64)[:len(cur_vec_list)]
+            # the Bloch encoding of swap tests does not keep the order of angles exactly, so the boundary
+            # points found before except the start are excluded, otherwise the search may never close
+            output[np.isin(candidate_index, self.convex_hull_index[1:])] = -np.inf
+            next_hull_index = int(candidate_index[np.argmax(output)])
             # next_hull_index = inner_product.get_inner_product_result(self.base_vec, cur_vec_list)
-            if next_hull_index >= self.base_index:
-                next_hull_index += 1
             self.convex_hull_set.append(self.points[next_hull_index])
+            self.convex_hull_index.append(next_hull_index)
             self.base_vec = self.normalization(np.array(self.convex_hull_set[-1]) - np.array(self.convex_hull_set[-2]))
             self.base_index = next_hull_index
 
         self.convex_hull_set = self.convex_hull_set[:-1]
+        self.convex_hull_index = self.convex_hull_index[:-1]
+        return self.convex_hull_index
 
 
 if __name__ == '__main__':
@@ -4,6 +4,7 @@ import time
 import argparse
 import sys
 import os
+from collections import deque
 from typing import Optional
 
 import numpy as np
@@ -23,10 +24,13 @@ from utils import NOT_gate, util, execute
 from dataset import test
 from QUOTA import quota_util
 
+# the number of recent Grover repetitions kept in the history
+HISTORY_SIZE = 64
+
 
 class OptimalPath:
     def __init__(self, point_num: int, points: list, cycle_type: bool, precision: int, env: str, backend: Optional[str],
-                 noisy: bool, print_detail: bool):
+                 noisy: bool, print_detail: bool, batch_size: int = 1):
         """
         :param point_num: int, the number of cities in the route
         :param points: list, coordinates of all cities
@@ -36,6 +40,7 @@ class OptimalPath:
         :param backend: string, the backend name when running the circuit on real quantum devices
         :param noisy: boolean, whether to add noise to circuit on simulators
         :param print_detail, boolean, whether to print the execution detail
+        :param batch_size: int, the number of Grover iteration counts submitted as one job in each repetition
         """
         # determining whether the input is legal
         quota_util.validate_inputs(point_num, points)
@@ -76,6 +81,13 @@ class OptimalPath:
         self.backend = backend
         self.noisy = noisy
         self.job = None
+        self.shots = 2000
+        self.batch_size = max(1, batch_size)
+
+        # (threshold, the numbers of Grover iterations, the cost of the best sampled route) of recent repetitions
+        self.history = deque(maxlen=HISTORY_SIZE)
+        # the comparators of the Grover iteration and their inverses, keyed by threshold
+        self.comparators = dict()
 
         # fixed circuit
         self.qc_start, self.qc_end = None, None
@@ -375,9 +387,20 @@ class OptimalPath:
 
         return route
 
-    def async_grover(self):
+    def get_comparator(self, threshold: float) -> tuple:
+        """
+        the comparator marking the routes whose cost is not less than the threshold, built once per threshold
+        """
+        if threshold not in self.comparators:
+            comparator = lib.IntegerComparator(self.precision, threshold, geq=True)
+            self.comparators[threshold] = (comparator, comparator.inverse())
+        return self.comparators[threshold]
+
+    def build_grover_circuit(self, threshold: float, iter_num: int) -> QuantumCircuit:
         """
-        executing the quantum circuit and iteratively obtaining the optimal solution
+        building the circuit of one Grover repetition
+        :param threshold: float, the cost of the best known route
+        :param iter_num: int, the number of Grover iterations
         """
         qram = QuantumRegister(self.qram_num)
         buffer = QuantumRegister(self.buffer_num)
@@ -390,60 +413,109 @@ class OptimalPath:
         qc.x(res[-1])
         qc.h(res[-1])
 
-        max_iter_bound = m.pi / 4.0 * m.sqrt(2 ** self.qram_num)
+        comparator, comparator_inverse = self.get_comparator(threshold)
+        for _ in range(iter_num):
+            qc.append(self.qc_start, [i for i in range(self.total_qubit_num)])
+            qc.append(comparator, [*buffer[:self.precision], res[1], *anc[:self.precision - 1]])
+            qc.ccx(res[0], res[1], res[-1])
+            qc.append(comparator_inverse, [*buffer[:self.precision], res[1], *anc[:self.precision - 1]])
+            qc.append(self.qc_end, [i for i in range(self.total_qubit_num)])
 
-        # qc_start, qc_end = self.build_partial_circuit()
-        # print(qc_start)
-        # print(qc_end)
+        qc.measure(qram, cl)
+        return qc
 
-        if self.job is not None:
-            output = execute.get_output(self.job, self.env)
-            if self.env == 'sim':
-                output = sorted(output.items(), key=lambda item: item[1], reverse=True)[0][0]
-            else:
-                output = sorted(output.items(), key=lambda item: item[1], reverse=True)
-                output = util.int_to_binary(output[0][0], self.qram_num)
-            new_path = self.translate_route(output)
-            new_threshold = self.cal_single_route_dist(new_path)
+    def sample_iter_nums(self, iter_min_num: float, iter_max_num: float) -> list:
+        """
+        choosing batch_size different numbers of Grover iterations in [iter_min_num, iter_max_num]
+        """
+        candidates = range(int(iter_min_num), int(iter_max_num) + 1)
+        return sorted(random.sample(candidates, min(self.batch_size, len(candidates))))
+
+    def prepare_grover_circuits(self, threshold: float, iter_nums: list) -> list:
+        """
+        building and transpiling the circuits of one Grover repetition, one for each number of iterations
+        """
+        trans_qcs = []
+        for iter_num in iter_nums:
+            qc = self.build_grover_circuit(threshold, iter_num)
+            trans_qcs.append(execute.transpile_qcircuit(qc, self.env, self.noisy, self.backend))
+            if self.print_detail:
+                print("The circuit depth before transpile", qc.depth())
+                print("The circuit depth after transpile", trans_qcs[-1].depth())
+        return trans_qcs
+
+    def get_route(self, output) -> list:
+        """
+        the most frequent route in the output of a circuit
+        """
+        if self.env == 'sim':
+            output = sorted(output.items(), key=lambda item: item[1], reverse=True)[0][0]
+        else:
+            output = sorted(output.items(), key=lambda item: item[1], reverse=True)
+            output = util.int_to_binary(output[0][0], self.qram_num)
+        return self.translate_route(output)
+
+    def get_best_route(self, job) -> tuple[list, float]:
+        """
+        the best of the most frequent routes of all circuits in job
+        :return: the route and its cost
+        """
+        best_path, best_threshold = None, -1.0
+        for output in execute.get_outputs(job, self.env):
+            path = self.get_route(output)
+            threshold = self.cal_single_route_dist(path)
+            if threshold > best_threshold:
+                best_path, best_threshold = path, threshold
+        return best_path, best_threshold
+
+    def async_grover(self):
+        """
+        executing the quantum circuit and iteratively obtaining the optimal solution,
+        the circuits of the next repetition are built while the current job is running
+        """
+        max_iter_bound = m.pi / 4.0 * m.sqrt(2 ** self.qram_num)
+        if self.grover_repeat_num <= 0:
+            return
+
+        cur_threshold = self.threshold
+        cur_iter_nums = self.sample_iter_nums(self.grover_iter_min_num, self.grover_iter_max_num)
+        trans_qcs = self.prepare_grover_circuits(cur_threshold, cur_iter_nums)
+        self.job = execute.run_qcircuits(trans_qcs, self.shots, self.env, self.noisy, self.backend)
+        while True:
+            # speculating that the running job finds no better route, which keeps the threshold and only
+            # enlarges the upper bound of Grover iterations
+            next_qcs = None
+            if self.grover_repeat_num > 1:
+                next_iter_nums = self.sample_iter_nums(self.grover_iter_min_num,
+                                                       min(self.alpha * self.grover_iter_max_num, max_iter_bound))
+                next_qcs = self.prepare_grover_circuits(self.threshold, next_iter_nums)
+
+            new_path, new_threshold = self.get_best_route(self.job)
+            self.history.append((float(cur_threshold), cur_iter_nums, float(new_threshold)))
             if self.print_detail:
                 print("new_path: ", new_path)
 
             if new_threshold > self.threshold:
                 self.threshold = new_threshold
                 self.path = new_path
-                # self.grover_iter_min_num = min(self.grover_iter_min_num * 1.4, max_iter_bound)
                 self.grover_iter_min_num = 1.0 / 2 * (self.grover_iter_max_num + self.grover_iter_min_num)
-                # self.grover_iter_max_num = max(self.grover_iter_min_num, self.grover_iter_max_num)
-                # self.grover_repeat_num = round(m.log(m.sqrt(m.factorial(self.choice_num)), self.alpha))
                 self.grover_repeat_num = round(m.log(m.sqrt(2 ** self.qram_num) / self.grover_iter_max_num, self.alpha))
                 if self.print_detail:
                     print("new_threshold: ", new_threshold)
                     print("grover repeat num: ", self.grover_repeat_num)
+                # the speculative circuits are built with the old threshold
+                next_qcs = None
+                next_iter_nums = self.sample_iter_nums(self.grover_iter_min_num, self.grover_iter_max_num)
             else:
                 self.grover_repeat_num -= 1
                 self.grover_iter_max_num = min(self.alpha * self.grover_iter_max_num, max_iter_bound)
-        if self.grover_repeat_num == 0:
-            # self.session.close()
-            return
-
-        cur_iter_num = random.randint(int(self.grover_iter_min_num), int(self.grover_iter_max_num))
-        # print("cur_iter_num: ", cur_iter_num)
-        for _ in range(cur_iter_num):
-            qc.append(self.qc_start, [i for i in range(self.total_qubit_num)])
-            qc.append(lib.IntegerComparator(self.precision, self.threshold, geq=True),
-                      [*buffer[:self.precision], res[1], *anc[:self.precision - 1]])
-            qc.ccx(res[0], res[1], res[-1])
-            qc.append(lib.IntegerComparator(self.precision, self.threshold, geq=True).inverse(),
-                      [*buffer[:self.precision], res[1], *anc[:self.precision - 1]])
-            qc.append(self.qc_end, [i for i in range(self.total_qubit_num)])
-
-        qc.measure(qram, cl)
+            if self.grover_repeat_num <= 0:
+                break
 
-        # remote_backend: 32, 63
-        shots = 2000
-        self.job = execute.exec_qcircuit(qc, shots, self.env, self.noisy, self.backend)
-
-        self.async_grover()
+            cur_threshold, cur_iter_nums = self.threshold, next_iter_nums
+            if next_qcs is None:
+                next_qcs = self.prepare_grover_circuits(cur_threshold, cur_iter_nums)
+            self.job = execute.run_qcircuits(next_qcs, self.shots, self.env, self.noisy, self.backend)
 
     def main(self) -> list:
         """
@@ -480,6 +552,8 @@ if __name__ == '__main__':
     parser.add_argument('--backend', '-b', type=str, default=None, help='The backend to run program')
     parser.add_argument('--noisy', '-n', type=bool, default=False, help='determining whether to add noisy')
     parser.add_argument('--print_detail', '-pd', type=bool, default=True, help='Print detailed information')
+    parser.add_argument('--batch_size', '-bs', type=int, default=1,
+                        help='The number of Grover iteration counts submitted as one job in each repetition')
 
     args = parser.parse_args()
     if args.scale < 3 or args.scale > 7:
@@ -500,7 +574,7 @@ if __name__ == '__main__':
     }
     test_points = test_points_dict[args.scale]
     test = OptimalPath(args.scale + 1, test_points, args.cycle, args.precision, args.env, args.backend, args.noisy,
-                       args.print_detail)
+                       args.print_detail, args.batch_size)
     # print(test.dist_adj)
     # print(test.end_dists)
 
@@ -12,6 +12,7 @@ sys.path.insert(0, parent_dir_path)
 from entity.single_cluster import SingleCluster
 from entity.multi_cluster import MultiCluster
 from utils import util
+from utils.distance import DistanceMatrix
 from utils.read_dataset import read_dataset
 from SQUARE import square_util
 from clustering import q_means, qncut
@@ -21,7 +22,10 @@ from QCHSA.qchsa_main import ConvexHull
 
 class TSPSolution:
     def __init__(self, file_name: str, point_num: int, partition_method: str, cluster_max_size: int, env: str,
-                 backend: Optional[str], max_qubit_num: int, print_detail: bool):
+                 backend: Optional[str], max_qubit_num: int, print_detail: bool, solver: str = 'held_karp',
+                 inner_product_mode: str = 'circuit', qmeans_engine: str = 'quantum', seed: Optional[int] = None,
+                 qmeans_incremental: bool = False, balanced: bool = False, qmeans_batch_size: Optional[int] = None,
+                 hull_engine: str = 'monotone_chain'):
         """
         :param file_name: string, the file path of test case
         :param point_num: int, the number of point
@@ -31,15 +35,34 @@ class TSPSolution:
         :param backend: string, the backend name when running the circuit on real quantum devices
         :param max_qubit_num: int, maximum number of available qubits
         :param print_detail: boolean, whether to print the execution detail
+        :param solver: string, the exact solver of subproblems: held_karp or branch_and_bound
+        :param inner_product_mode: string, how swap tests are evaluated: circuit, analytic or sampled
+        :param qmeans_engine: string, the assignment method of QMeans: quantum or classical
+        :param seed: int, the random seed of graph partition and of the sampled swap tests in QAHCA
+        :param qmeans_incremental: boolean, whether QMeans only re-evaluates the points whose cluster may change
+        :param balanced: boolean, whether graph partition enforces cluster_max_size in one pass
+        :param qmeans_batch_size: int, the number of points in each iteration of mini-batch QMeans
+        :param hull_engine: string, the method finding the convex hulls of clusters: monotone_chain, qhull or qchsa
         """
         self.points = []
         self.point_num = point_num
-        self.point_map = dict()
+        # the label of each point in the dataset, indexed by point ID
+        self.point_labels = []
+        self.dist_matrix = None
+        # the point IDs in the order of the final route
         self.path = []
 
         self.partition_method = partition_method
         self.cluster_max_size = cluster_max_size
         self.max_qubit_num = max_qubit_num
+        self.solver = solver
+        self.inner_product_mode = inner_product_mode
+        self.qmeans_engine = qmeans_engine
+        self.seed = seed
+        self.qmeans_incremental = qmeans_incremental
+        self.balanced = balanced
+        self.qmeans_batch_size = qmeans_batch_size
+        self.hull_engine = hull_engine
 
         self.x_bounds = [10000, 0]
         self.y_bounds = [10000, 0]
@@ -60,7 +83,7 @@ class TSPSolution:
             point = line.strip().split(' ')
             point = [int(point[0]), float(point[1]), float(point[2])]
             self.points.append((point[1], point[2]))
-            self.point_map[(point[1], point[2])] = point[0]
+            self.point_labels.append(point[0])
 
             if point[1] < self.x_bounds[0]:
                 self.x_bounds[0] = point[1]
@@ -70,14 +93,21 @@ class TSPSolution:
                 self.y_bounds[0] = point[2]
             if point[2] > self.y_bounds[1]:
                 self.y_bounds[1] = point[2]
+        self.dist_matrix = DistanceMatrix(self.points)
         print(f"x_bound: {self.x_bounds}, y_bound: {self.y_bounds}")
 
     def graph_partition_q_means(self):
         """
         using QMeans to graph partition
         """
-        split_cluster_num = self.point_num // self.cluster_max_size
-        self.path = q_means.divide_clusters(self.points, split_cluster_num, self.env, self.backend, self.max_qubit_num)
+        self.path = q_means.divide_clusters(self.points, self.cluster_max_size, self.env, self.backend,
+                                            self.max_qubit_num, dist_matrix=self.dist_matrix,
+                                            inner_product_mode=self.inner_product_mode, engine=self.qmeans_engine,
+                                            seed=self.seed, incremental=self.qmeans_incremental,
+                                            balanced=self.balanced, batch_size=self.qmeans_batch_size)
+        for cluster in self.path:
+            cluster.solver = self.solver
+            cluster.set_hull_engine(self.hull_engine, self.max_qubit_num)
         if self.print_detail:
             print(len(self.path))
 
@@ -85,7 +115,12 @@ class TSPSolution:
         """
         using QNCut to graph partition
         """
-        self.path = qncut.divide_clusters(self.points, self.env, self.backend, self.print_detail, self.cluster_max_size)
+        self.path = qncut.divide_clusters(self.points, self.env, self.backend, self.print_detail, self.cluster_max_size,
+                                          dist_matrix=self.dist_matrix, inner_product_mode=self.inner_product_mode,
+                                          balanced=self.balanced, seed=self.seed)
+        for cluster in self.path:
+            cluster.solver = self.solver
+            cluster.set_hull_engine(self.hull_engine, self.max_qubit_num)
         if self.print_detail:
             print(len(self.path))
 
@@ -127,11 +162,11 @@ class TSPSolution:
         """
         # if QUOTA can handle the problem independently
         if len(self.points) < self.cluster_max_size:
-            cur_cluster = SingleCluster(None, self.points, self.env, self.backend, self.print_detail)
+            cur_cluster = SingleCluster(None, np.arange(self.point_num), self.dist_matrix, self.env, self.backend,
+                                        self.print_detail, self.solver, self.inner_product_mode, self.hull_engine,
+                                        self.max_qubit_num)
             cur_cluster.find_optimal_circle(self.max_qubit_num)
-            cur_order = cur_cluster.get_nodes_in_path()
-            for point in cur_order:
-                self.path.append(self.point_map.get(point))
+            self.path = cur_cluster.elements.tolist()
             return
 
         # graph partition module
@@ -143,16 +178,18 @@ class TSPSolution:
         # subgraph problem planning module
         h_tree = HierarchicalTree(self.path, len(self.path), self.cluster_max_size - 1, self.x_bounds,
                                   self.y_bounds, self.max_qubit_num, self.env, self.backend,
-                                  self.print_detail)
+                                  self.print_detail, self.solver, self.inner_product_mode, seed=self.seed)
         h_tree.build_tree()
         # h_tree.classical_build_tree()
 
         # finding the optimal Hamiltonian cycle
-        self.path = [MultiCluster(None, self.path, self.env, self.backend, self.print_detail)]
+        # the top-level clusters are copied, since the list of h_tree must not be changed by the circle
+        self.path = [MultiCluster(None, list(self.path), self.env, self.backend, self.print_detail, self.solver)]
         self.path[0].find_optimal_circle(self.max_qubit_num)
         self.path = self.path[0].elements
 
-        h_tree.decompose_tree()
+        # the tree is decomposed along the optimal circle rather than the order of merging
+        h_tree.decompose_tree(self.path)
 
         # setting the start and end points for each underlying cluster and rearrange the vertices order
         for i in range(len(self.path)):
@@ -167,17 +204,19 @@ class TSPSolution:
             self.path[i].find_optimal_path(self.max_qubit_num)
 
         # restoring to a single vertices state
-        for i in range(len(self.path) - 1, -1, -1):
-            self.path[i: i + 1] = self.path[i].elements
+        self.path = [int(point_id) for cluster in self.path for point_id in cluster.elements]
 
         if self.print_detail:
-            square_util.draw_result(self.point_num, self.path)
+            square_util.draw_result(self.point_num, self.dist_matrix.coords[self.path])
+
+    def get_route_labels(self) -> list:
+        """
+        the final route represented by the point labels in the dataset
+        """
+        return [self.point_labels[point_id] for point_id in self.path]
 
     def cal_total_cost(self):
-        dist = 0.
-        for i in range(self.point_num):
-            dist += util.cal_similarity(self.path[i - 1], self.path[i])
-        return dist
+        return self.dist_matrix.path_len(self.path)
 
     def get_accuracy(self):
         dist = self.cal_total_cost()
@@ -202,11 +241,29 @@ if __name__ == '__main__':
     parser.add_argument('--max_qubit_num', '-m', type=int, default=15,
                         help='The maximum number of qubits in the backend')
     parser.add_argument('--print_detail', '-pd', type=bool, default=False, help='Print detailed information')
+    parser.add_argument('--solver', '-so', type=str, default='held_karp',
+                        help='The exact solver of subproblems: held_karp or branch_and_bound')
+    parser.add_argument('--inner_product_mode', '-ipm', type=str, default='circuit',
+                        help='The evaluation of swap tests, parameter: "circuit"; "analytic"; "sampled"')
+    parser.add_argument('--qmeans_engine', '-qe', type=str, default='quantum',
+                        help='The assignment method of Q-means, parameter: "quantum"; "classical"')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='The random seed of graph partition and sampled swap tests')
+    parser.add_argument('--qmeans_incremental', '-qi', type=bool, default=False,
+                        help='Only re-evaluate the points whose cluster may change in Q-means')
+    parser.add_argument('--balanced', '-bl', type=bool, default=False,
+                        help='Enforce the maximum size of clusters in graph partition')
+    parser.add_argument('--qmeans_batch_size', '-qb', type=int, default=None,
+                        help='The number of points in each iteration of mini-batch Q-means')
+    parser.add_argument('--hull_engine', '-he', type=str, default='monotone_chain',
+                        help='The method finding convex hulls, parameter: "monotone_chain"; "qhull"; "qchsa"')
 
     args = parser.parse_args()
 
     test = TSPSolution(args.file_name, args.scale, args.partition_method, args.cluster_max_size, args.env, args.backend,
-                       args.max_qubit_num, args.print_detail)
+                       args.max_qubit_num, args.print_detail, args.solver, args.inner_product_mode,
+                       args.qmeans_engine, args.seed, args.qmeans_incremental, args.balanced,
+                       args.qmeans_batch_size, args.hull_engine)
     test.main()
-    print(test.path)
+    print(test.get_route_labels())
     test.get_accuracy()
@@ -9,7 +9,6 @@ import matplotlib.pyplot as plt
 dir_path = os.path.dirname(os.path.realpath(__file__))
 parent_dir_path = os.path.abspath(os.path.join(dir_path, os.pardir))
 sys.path.insert(0, parent_dir_path)
-from utils import util
 
 
 def spectral_clustering(points, cluster_num):
@@ -41,17 +40,9 @@ def cal_dist_point_to_line(point, line_start, line_end):
 def find_diff_clusters_connector(cluster_1, cluster_2):
     points_1 = cluster_1.get_convex_hull()
     points_2 = cluster_2.get_convex_hull()
-    conn_min_dist = 10000
-    conn_begin = 0
-    conn_end = 0
-    for i in range(len(points_1)):
-        for j in range(len(points_2)):
-            cur_dist = util.cal_similarity(points_1[i], points_2[j])
-            if cur_dist < conn_min_dist:
-                conn_min_dist = cur_dist
-                conn_begin = i
-                conn_end = j
-    return points_1[conn_begin], points_2[conn_end]
+    dists = cluster_1.dist_matrix.cross_matrix(points_1, points_2)
+    conn_begin, conn_end = np.unravel_index(dists.argmin(), dists.shape)
+    return int(points_1[conn_begin]), int(points_2[conn_end])
 
 
 def draw_result(point_num, ordered_cycle):
@@ -1,70 +1,102 @@
 import math as m
 import numpy as np
 from sklearn.neighbors import kneighbors_graph
+from scipy import sparse
 from scipy.sparse.csgraph import laplacian
+from scipy.spatial.distance import cdist
 from sklearn.neighbors import NearestNeighbors
 import pandas as pd
+from QCHSA.qchsa_main import monotone_chain
 
 from qiskit import QuantumRegister, QuantumCircuit
 import qiskit.circuit.library as lib
 
 
-def build_gaussian_adj(adj_matrix: np.ndarray, point_num: int) -> np.ndarray:
+def build_gaussian_adj(adj_matrix, point_num: int, dtype=np.float64, extent=None):
     """
     Transform all elements in adjacency matrix into the form of gaussian
-    :param adj_matrix: numpy array
+    :param adj_matrix: numpy array or scipy sparse matrix, whose zero elements are kept as zero
     :param point_num: int
+    :param dtype: the data type of output, e.g. np.float32 halves the memory
+    :param extent: float, the length that the bandwidth of gaussian is proportional to, the range of elements by
+                   default; it should not depend on the stored elements of a sparse matrix, otherwise the k-NN graph
+                   is not the dense one truncated to its edges
     :return: adj_matrix in the form of gaussian
     """
-    min_element = adj_matrix.min()
-    max_element = adj_matrix.max()
-    sigma = (max_element - min_element) * 0.15
-
-    adj_transform = np.zeros((point_num, point_num))
-    for i in range(point_num):
-        for j in range(point_num):
-            if adj_matrix[i][j] != 0.0:
-                adj_transform[i][j] = np.exp(-np.square(np.array(adj_matrix[i][j]) / sigma) / 2)
+    if sparse.issparse(adj_matrix):
+        adj_transform = adj_matrix.tocsr().astype(dtype)
+        elements = adj_transform.data
+    else:
+        adj_transform = np.zeros((point_num, point_num), dtype=dtype)
+        elements = adj_matrix
+    if extent is None:
+        # the diagonal is zero, which is not stored in a sparse matrix
+        extent = elements.max() - min(elements.min(), 0.) if elements.size else 0.
+    sigma = extent * 0.15
+
+    is_edge = elements != 0.0
+    gaussian = np.exp(-np.square(elements[is_edge] / sigma) / 2)
+    if sparse.issparse(adj_transform):
+        elements[is_edge] = gaussian
+        adj_transform.eliminate_zeros()
+    else:
+        adj_transform[is_edge] = gaussian
     return adj_transform
 
 
-def build_adj_matrix(points: list, point_num: int) -> np.ndarray:
+def cal_diameter(coords: np.ndarray) -> float:
+    """
+    the largest distance between the points, which is reached between two vertices of their convex hull
+    :param coords: numpy array with the shape of (n, 2)
+    """
+    hull = coords[monotone_chain(coords)]
+    return float(cdist(hull, hull).max()) if len(hull) else 0.
+
+
+def build_adj_matrix(points: list, point_num: int, dtype=np.float64, neighbor_num=None):
     """
     Build adjacency matrix from points
     :param points: list
     :param point_num: int
-    :return: numpy array
+    :param dtype: the data type of output
+    :param neighbor_num: int, only the edges between each point and its nearest neighbor_num points are kept in a
+                         scipy sparse matrix if given
+    :return: numpy array, or scipy sparse matrix when neighbor_num is given
     """
-    adj_matrix = np.zeros((point_num, point_num))
-    for i in range(point_num):
-        for j in range(i + 1, point_num):
-            adj_matrix[i][j] = adj_matrix[j][i] = np.linalg.norm(np.array(points[i]) - np.array(points[j]))
+    coords = np.asarray(points, dtype=np.float64).reshape(point_num, 2)
+    # the bandwidth of gaussian is proportional to the diameter of points in both the dense and the sparse matrix
+    if neighbor_num is None:
+        adj_matrix = cdist(coords, coords)
+        extent = adj_matrix.max()
+    else:
+        adj_matrix = kneighbors_graph(coords, min(neighbor_num, point_num - 1), mode='distance')
+        # the k-NN relation is not symmetric
+        adj_matrix = adj_matrix.maximum(adj_matrix.T)
+        extent = cal_diameter(coords)
     # transfer to gaussian
-    adj_matrix = build_gaussian_adj(adj_matrix, point_num)
+    adj_matrix = build_gaussian_adj(adj_matrix, point_num, dtype, extent)
     # enlarge all elements from the range of [0, 1] to [0, 10]
     adj_matrix *= 10
     return adj_matrix
 
 
-def build_deg_matrix(adj_matrix: np.ndarray, point_num: int) -> list:
+def build_deg_matrix(adj_matrix, point_num: int) -> list:
     """
     Build degree matrix from adjacency matrix
     :param point_num: int
-    :param adj_matrix: numpy array
+    :param adj_matrix: numpy array or scipy sparse matrix
     :return: list
     """
-    deg_matrix = list()
-    for i in range(point_num):
-        deg_matrix.append(sum(adj_matrix[i]))
+    deg_matrix = np.asarray(adj_matrix.sum(axis=1), dtype=np.float64).reshape(point_num)
 
     # normalize to the range of [0, 1]
-    min_deg = min(deg_matrix)
-    max_deg = max(deg_matrix)
-    delta_deg = max_deg - min_deg
-    for i in range(point_num):
-        deg_matrix[i] = (deg_matrix[i] - min_deg) / delta_deg
-
-    return deg_matrix
+    min_deg = deg_matrix.min()
+    delta_deg = deg_matrix.max() - min_deg
+    if delta_deg <= 1e-9 * abs(deg_matrix.max()):
+        # all degrees are the same up to rounding errors, e.g. the points of a regular polygon, so they are all
+        # regarded as the maximum
+        return np.ones(point_num).tolist()
+    return ((deg_matrix - min_deg) / delta_deg).tolist()
 
 
 def scaling_up_deg_matrix(deg_matrix: list, point_num: int) -> list:
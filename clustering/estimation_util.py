@@ -1,4 +1,15 @@
 import numpy as np
+from scipy.spatial.distance import cdist, pdist
+
+
+def to_coords(cluster) -> np.ndarray:
+    """
+    getting the coordinates of all points in cluster as a numpy array with the shape of (n, 2)
+    :param cluster: SingleCluster or list of coordinates
+    """
+    if hasattr(cluster, 'get_coords'):
+        return cluster.get_coords()
+    return np.asarray(cluster, dtype=np.float64).reshape(-1, 2)
 
 
 def cal_cut_similarity(cluster_1, cluster_2, sigma) -> float:
@@ -8,23 +19,15 @@ def cal_cut_similarity(cluster_1, cluster_2, sigma) -> float:
     :param cluster_2: list, the second cluster
     :param sigma: float, the standard deviation
     """
-    similarity = 0.
-    for element_1 in cluster_1.elements:
-        for element_2 in cluster_2.elements:
-            cur_dist = np.linalg.norm(np.array(element_1) - np.array(element_2))
-            similarity += np.exp(-np.square(np.array(cur_dist) / sigma) / 2)
-    return similarity
+    dists = cdist(to_coords(cluster_1), to_coords(cluster_2))
+    return float(np.exp(-np.square(dists / sigma) / 2).sum())
 
 
 def cal_cut_weights(cluster_1, cluster_2) -> float:
     """
     calculating the weights of different clusters
     """
-    weights = 0.
-    for element_1 in cluster_1.elements:
-        for element_2 in cluster_2.elements:
-            weights += np.linalg.norm(np.array(element_1) - np.array(element_2))
-    return weights
+    return float(cdist(to_coords(cluster_1), to_coords(cluster_2)).sum())
 
 
 def cal_similarity(cluster, sigma) -> float:
@@ -33,12 +36,8 @@ def cal_similarity(cluster, sigma) -> float:
     :param cluster: list
     :param sigma: float, the standard deviation
     """
-    similarity = 0.
-    for i in range(cluster.element_num):
-        for j in range(i + 1, cluster.element_num):
-            cur_dist = np.linalg.norm(np.array(cluster.elements[i]) - np.array(cluster.elements[j]))
-            similarity += np.exp(-np.square(np.array(cur_dist) / sigma) / 2)
-    return similarity
+    dists = pdist(to_coords(cluster))
+    return float(np.exp(-np.square(dists / sigma) / 2).sum())
 
 
 def cal_weights(cluster) -> float:
@@ -46,11 +45,7 @@ def cal_weights(cluster) -> float:
     calculating the weight of cluster
     :param cluster: list
     """
-    weights = 0.
-    for i in range(cluster.element_num):
-        for j in range(i + 1, cluster.element_num):
-            weights += np.linalg.norm(np.array(cluster.elements[i]) - np.array(cluster.elements[j]))
-    return weights
+    return float(pdist(to_coords(cluster)).sum())
 
 
 def estimation_with_similarity(clusters, points, print_detail=False) -> tuple[float, float]:
@@ -60,15 +55,9 @@ def estimation_with_similarity(clusters, points, print_detail=False) -> tuple[fl
     :param points: list, all cities
     :param print_detail: boolean, whether to print the execution detail
     """
-    max_dist = 0.0
-    min_dist = 100000.
-    for i in range(len(points)):
-        for j in range(i + 1, len(points)):
-            dist = np.linalg.norm(np.array(points[i]) - np.array(points[j]))
-            if dist > max_dist:
-                max_dist = dist
-            if dist < min_dist:
-                min_dist = dist
+    dists = pdist(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    max_dist = dists.max()
+    min_dist = dists.min()
     sigma = (max_dist - min_dist) * 0.15
 
     if print_detail:
@@ -2,9 +2,13 @@
 import argparse
 import sys
 import os
-import random
 import math as m
+from typing import Optional
+
 import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog
+from scipy.spatial import cKDTree
 
 import matplotlib
 
@@ -15,10 +19,21 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 parent_dir_path = os.path.abspath(os.path.join(dir_path, os.pardir))
 sys.path.insert(0, parent_dir_path)
 from utils import inner_product
+from utils.job_pipeline import MAX_IN_FLIGHT
 from entity.single_cluster import SingleCluster
+from utils.distance import DistanceMatrix
 from utils.read_dataset import read_dataset
 import estimation_util
 
+# quantum: assigning points by swap tests; classical: assigning points by the Manhattan distance
+ENGINES = ('quantum', 'classical')
+# the classical engine queries a KD-tree of centroids instead of broadcasting when there are more clusters
+KDTREE_MIN_CLUSTER_NUM = 64
+# k-means++: spreading the initial centroids by distance; random: drawing the initial centroids uniformly
+INIT_METHODS = ('k-means++', 'random')
+# the number of nearest clusters that each point may be assigned to in the capacitated assignment at first
+CAPACITY_NEIGHBOR_NUM = 16
+
 
 class Job:
     def __init__(self, job, range_2):
@@ -27,7 +42,9 @@ class Job:
 
 
 class QMeans:
-    def __init__(self, points, cluster_num, env, backend, max_qubit_num, print_detail=False):
+    def __init__(self, points, cluster_num, env, backend, max_qubit_num, print_detail=False, point_ids=None,
+                 dist_matrix=None, inner_product_mode='circuit', max_in_flight=MAX_IN_FLIGHT, engine='quantum',
+                 init_method='k-means++', seed=None, incremental=False, capacity=None, batch_size=None):
         """
         :param points: list, coordinates of all cities
         :param cluster_num: int, the number of clusters that need to divide
@@ -35,11 +52,55 @@ class QMeans:
         :param backend: string, the backend name when running the circuit on real quantum devices
         :param max_qubit_num: int, maximum number of available qubits
         :param print_detail: boolean, whether to print the execution detail
+        :param point_ids: list, the IDs of points in dist_matrix, the i-th point is regarded as ID i by default
+        :param dist_matrix: DistanceMatrix, the shared coordinate store, built from points by default
+        :param inner_product_mode: string, how swap tests are evaluated: circuit, analytic or sampled
+        :param max_in_flight: int, the maximum number of unfinished swap-test jobs
+        :param engine: string, the assignment method in iterations: quantum or classical
+        :param init_method: string, the choice of initial centroids: k-means++ or random
+        :param seed: int or numpy Generator, the source of randomness, which is shared when a Generator is given
+        :param incremental: boolean, whether the quantum engine only re-evaluates the points whose cluster may change
+        :param capacity: int, the maximum size of each cluster, which is enforced in every assignment if given
+        :param batch_size: int, the number of points drawn in each iteration of mini-batch QMeans, all points are
+                           assigned in each iteration by default
         """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown QMeans engine: {engine}, the options are {list(ENGINES)}")
+        if init_method not in INIT_METHODS:
+            raise ValueError(f"Unknown QMeans init method: {init_method}, the options are {list(INIT_METHODS)}")
+        if capacity is not None and capacity * cluster_num < len(points):
+            raise ValueError(f"{cluster_num} clusters of capacity {capacity} cannot hold {len(points)} points")
+        if capacity is not None and incremental:
+            raise ValueError("The incremental assignment only supports clusters without capacity")
+        if batch_size is not None and (capacity is not None or incremental):
+            raise ValueError("Mini-batch QMeans does not support the capacity or the incremental assignment")
         self.points = points
+        self.coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.dist_matrix = dist_matrix if dist_matrix is not None else DistanceMatrix(points)
+        self.point_ids = np.asarray(point_ids if point_ids is not None else np.arange(len(points)), dtype=np.int32)
         self.cluster_num = cluster_num
         self.iter_num = 15
-        self.centroids = []
+        self.engine = engine
+        self.init_method = init_method
+        self.rng = np.random.default_rng(seed)
+        self.incremental = incremental
+        self.capacity = capacity
+        # mini-batch iterations are pointless when a batch covers all points
+        self.batch_size = batch_size if batch_size is not None and batch_size < len(self.coords) else None
+        # the number of points that have been assigned to each cluster in mini-batch iterations
+        self.batch_counts = np.zeros(cluster_num, dtype=np.int64)
+        # the bounds of the state distance between each point and its own centroid (upper) or any other
+        # centroid (lower), which are valid for bound_centroids
+        self.upper_bounds = None
+        self.lower_bounds = None
+        self.bound_centroids = None
+        # the number of point-centroid pairs evaluated by swap tests
+        self.swap_test_num = 0
+        # numpy array with the shape of (cluster_num, 2)
+        self.centroids = None
+        # the cluster of each point
+        self.labels = np.zeros(len(self.coords), dtype=np.int64)
+        # the indices of points in each cluster
         self.clusters = [[] for _ in np.arange(self.cluster_num)]
         self.range = None
         self.x_range = None
@@ -48,6 +109,8 @@ class QMeans:
 
         self.env = env
         self.backend = backend
+        self.inner_product_mode = inner_product_mode
+        self.max_in_flight = max_in_flight
         # if self.env == 'sim':
         #     self.backend = AerSimulator()
         # else:
@@ -62,7 +125,9 @@ class QMeans:
         """
         self.init_range()
         self.init_centroid()
-        self.init_clusters()
+        # the points of mini-batch QMeans are assigned in the final pass
+        if self.batch_size is None:
+            self.init_clusters()
         if self.print_detail:
             print("---------------initialization: ----------------------")
             print("centroids: ", self.centroids)
@@ -72,18 +137,38 @@ class QMeans:
         """
         initial the centroids for each cluster
         """
-        centroid_set = set()
-        point_num = len(self.points)
-        while len(centroid_set) < self.cluster_num:
-            tmp_index = random.randint(0, point_num - 1)
-            if tmp_index not in centroid_set:
-                centroid_set.add(tmp_index)
-                self.centroids.append(self.points[tmp_index])
+        coords = self.coords
+        if self.batch_size is not None:
+            # mini-batch QMeans only draws the initial centroids from a sample of points
+            sample_size = min(len(coords), max(3 * self.cluster_num, self.batch_size))
+            coords = coords[self.rng.choice(len(coords), sample_size, replace=False)]
+        point_num = len(coords)
+        if self.init_method == 'random':
+            self.centroids = coords[self.rng.choice(point_num, self.cluster_num, replace=False)]
+            return
+
+        # k-means++: each new centroid is drawn with the probability proportional to the squared distance
+        # between the point and its nearest chosen centroid
+        centroid_indices = [int(self.rng.integers(point_num))]
+        min_dists = np.abs(coords - coords[centroid_indices[0]]).sum(axis=1)
+        for _ in range(1, self.cluster_num):
+            weights = min_dists ** 2
+            total = weights.sum()
+            if total > 0:
+                index = int(self.rng.choice(point_num, p=weights / total))
+            else:
+                # all remaining points coincide with chosen centroids
+                index = int(self.rng.choice(np.setdiff1d(np.arange(point_num), centroid_indices)))
+            centroid_indices.append(index)
+            min_dists = np.minimum(min_dists, np.abs(coords - coords[index]).sum(axis=1))
+        self.centroids = coords[centroid_indices]
 
     def init_clusters(self):
         # the classical method
-        for point in self.points:
-            self.clusters[self.classical_find_optimal_cluster(point)].append(point)
+        if self.capacity is not None:
+            self.set_labels(self.capacitated_assign())
+        else:
+            self.set_labels(self.classical_find_optimal_clusters(self.coords))
 
         # the quantum method
         # tmp_points = [point for point in self.points]
@@ -93,8 +178,8 @@ class QMeans:
         #     self.clusters[id].append(self.points[i])
 
     def init_range(self):
-        min_x, max_x = min([point[0] for point in self.points]), max([point[0] for point in self.points])
-        min_y, max_y = min([point[1] for point in self.points]), max([point[1] for point in self.points])
+        min_x, min_y = self.coords.min(axis=0).tolist()
+        max_x, max_y = self.coords.max(axis=0).tolist()
         self.range = max(max_x - min_x, max_y - min_y)
         self.x_range = [min_x, max_x]
         self.y_range = [min_y, max_y]
@@ -129,111 +214,277 @@ class QMeans:
         calculating the optimal cluster which the point belongs to
         :param point: list
         """
-        min_dist = 1000
-        min_id = -1
-        for i in range(len(self.centroids)):
-            cur_dist = abs(point[0] - self.centroids[i][0]) + abs(point[1] - self.centroids[i][1])
-            if cur_dist < min_dist:
-                min_dist = cur_dist
-                min_id = i
-        return min_id
+        return int(self.classical_find_optimal_clusters(np.asarray(point, dtype=np.float64).reshape(1, 2))[0])
 
-    def find_optimal_cluster(self, points) -> list:
+    def classical_find_optimal_clusters(self, coords: np.ndarray) -> np.ndarray:
         """
-        using quantum method to find the optimal cluster which points belong to
+        calculating the nearest centroid of each point in the Manhattan distance
+        :param coords: numpy array with the shape of (n, 2)
+        :return: the cluster of each point
+        """
+        if self.cluster_num >= KDTREE_MIN_CLUSTER_NUM:
+            _, labels = cKDTree(self.centroids).query(coords, p=1)
+            return labels.astype(np.int64)
+        return self.classical_cal_dists(coords).argmin(axis=1)
+
+    def classical_cal_dists(self, coords: np.ndarray) -> np.ndarray:
+        """
+        the Manhattan distances between points and all centroids
+        :param coords: numpy array with the shape of (n, 2)
+        :return: numpy array with the shape of (n, cluster_num)
+        """
+        return np.abs(coords[:, np.newaxis, :] - self.centroids[np.newaxis, :, :]).sum(axis=2)
+
+    def capacitated_assign(self, costs: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        assigning points to clusters of at most capacity points with the minimum total cost. Each point is only
+        connected to its CAPACITY_NEIGHBOR_NUM nearest clusters, which are doubled until all points can be assigned,
+        so the problem has O(n) edges rather than the O(n ^ 2) of matching points with all capacity slots
+        :param costs: numpy array with the shape of (n, cluster_num), the cost of putting each point in each cluster,
+                      the Manhattan distances to centroids found by a KD-tree by default
+        :return: the cluster of each point
+        """
+        neighbor_num = min(CAPACITY_NEIGHBOR_NUM, self.cluster_num)
+        while True:
+            if costs is None:
+                nearest_costs, nearest = cKDTree(self.centroids).query(self.coords, k=neighbor_num, p=1)
+                nearest_costs = nearest_costs.reshape(len(self.coords), neighbor_num)
+                nearest = nearest.reshape(len(self.coords), neighbor_num)
+            else:
+                nearest = np.argpartition(costs, neighbor_num - 1, axis=1)[:, :neighbor_num]
+                nearest_costs = np.take_along_axis(costs, nearest, axis=1)
+            labels = self.transport(nearest, nearest_costs)
+            if labels is not None:
+                return labels
+            if neighbor_num == self.cluster_num:
+                raise ValueError(f"{self.cluster_num} clusters of capacity {self.capacity} cannot hold "
+                                 f"{len(self.coords)} points")
+            neighbor_num = min(2 * neighbor_num, self.cluster_num)
+
+    def transport(self, nearest: np.ndarray, nearest_costs: np.ndarray) -> Optional[np.ndarray]:
+        """
+        solving the min-cost flow from points to their candidate clusters of capacity as a transportation problem,
+        whose constraint matrix is totally unimodular, so the basic solution of the dual simplex method is integral
+        :param nearest: numpy array with the shape of (n, m), the candidate clusters of each point
+        :param nearest_costs: numpy array with the shape of (n, m), the cost of each candidate
+        :return: the cluster of each point, or None if the points cannot be assigned to their candidates
+        """
+        point_num, neighbor_num = nearest.shape
+        edges = np.arange(point_num * neighbor_num)
+        # each point is assigned once, and each cluster holds at most capacity points
+        point_rows = sparse.csr_matrix((np.ones(len(edges)), (edges // neighbor_num, edges)),
+                                       shape=(point_num, len(edges)))
+        cluster_rows = sparse.csr_matrix((np.ones(len(edges)), (nearest.ravel(), edges)),
+                                         shape=(self.cluster_num, len(edges)))
+        result = linprog(nearest_costs.ravel(), A_ub=cluster_rows, b_ub=np.full(self.cluster_num, self.capacity),
+                         A_eq=point_rows, b_eq=np.ones(point_num), bounds=(0, 1), method='highs-ds')
+        if result.status != 0:
+            return None
+        choices = result.x.reshape(point_num, neighbor_num).argmax(axis=1)
+        return nearest[np.arange(point_num), choices].astype(np.int64)
+
+    def set_labels(self, labels):
+        """
+        updating the cluster of each point and the points of each cluster
+        :param labels: list or numpy array, the cluster of each point
+        """
+        self.labels = np.asarray(labels, dtype=np.int64)
+        order = np.argsort(self.labels, kind='stable')
+        bounds = np.searchsorted(self.labels[order], np.arange(self.cluster_num + 1))
+        self.clusters = [order[bounds[i]: bounds[i + 1]].tolist() for i in range(self.cluster_num)]
+
+    def cal_similarities(self, points) -> np.ndarray:
+        """
+        estimating the similarities between points and all centroids by swap tests
         :param points: list
+        :return: numpy array with the shape of (len(points), cluster_num)
         """
         task_num_per_circuit = self.max_qubit_num // 3
 
         norm_cents = [inner_product.normalization(centroid, self.x_range[0], self.y_range[0], self.range) for centroid
                       in self.centroids]
-        jobs = list()
-        output = list()
         vec_list_1 = list()
         vec_list_2 = list()
-        cur_cal_num = task_num_per_circuit
-
         for point in points:
             norm_point = inner_product.normalization(point, self.x_range[0], self.y_range[0], self.range)
             for i in range(self.cluster_num):
                 vec_list_1.append(norm_point)
                 vec_list_2.append(norm_cents[i])
-                cur_cal_num -= 1
-
-                if cur_cal_num <= 0:
-                    cur_cal_num = task_num_per_circuit
-                    jobs.append(inner_product.cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, self.env,
-                                                                self.backend, self.print_detail))
-
-                    vec_list_1.clear()
-                    vec_list_2.clear()
-
-                    if len(jobs) >= 3:
-                        for job in jobs:
-                            output += inner_product.get_inner_product_result(job, task_num_per_circuit, self.env)
-
-                        jobs.clear()
 
-        if vec_list_1:
-            jobs.append(inner_product.cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, self.env,
-                                                        self.backend, self.print_detail))
-        for job in jobs:
-            output += inner_product.get_inner_product_result(job, task_num_per_circuit, self.env)
+        output = inner_product.cal_inner_products(vec_list_1, vec_list_2, task_num_per_circuit, self.env,
+                                                  self.backend, self.print_detail, self.inner_product_mode,
+                                                  self.max_in_flight, rng=self.rng)
+        self.swap_test_num += len(output)
 
         if self.print_detail:
             print("output: ", output)
-        new_cluster_id_list = list()
-        for i in range(len(points)):
-            new_cluster_id_list.append(output[i * self.cluster_num: (i + 1) * self.cluster_num].index(
-                max(output[i * self.cluster_num: (i + 1) * self.cluster_num])))
+        return np.asarray(output, dtype=np.float64).reshape(len(points), self.cluster_num)
+
+    def find_optimal_cluster(self, points) -> list:
+        """
+        using quantum method to find the optimal cluster which points belong to
+        :param points: list
+        """
+        new_cluster_id_list = self.cal_similarities(points).argmax(axis=1).tolist()
         if self.print_detail:
             print("new_cluster_id_list: ", new_cluster_id_list)
 
         return new_cluster_id_list
 
+    def get_states(self, coords) -> list:
+        """
+        the normalized vectors which are encoded into the states of swap tests
+        """
+        return [inner_product.normalization(point, self.x_range[0], self.y_range[0], self.range) for point in coords]
+
+    def incremental_find_optimal_cluster(self) -> np.ndarray:
+        """
+        using quantum method to find the optimal clusters like Hamerly's k-means, the bounds of state distances are
+        loosened by how far the centroids move, and only the points whose upper bound exceeds the lower bound are
+        sent to swap tests again, the bounds are as accurate as the estimated similarities
+        :return: the cluster of each point
+        """
+        if self.bound_centroids is None:
+            candidates = np.arange(len(self.coords))
+            self.upper_bounds = np.zeros(len(self.coords))
+            self.lower_bounds = np.zeros(len(self.coords))
+        else:
+            # the exact state distances that centroids moved
+            shifts = inner_product.to_state_dists(inner_product.cal_swap_test_prob(
+                self.get_states(self.bound_centroids), self.get_states(self.centroids)))
+            self.upper_bounds += shifts[self.labels]
+            order = np.argsort(shifts)[::-1]
+            second_shift = shifts[order[1]] if self.cluster_num > 1 else 0
+            self.lower_bounds -= np.where(self.labels == order[0], second_shift, shifts[order[0]])
+            candidates = np.flatnonzero(self.upper_bounds > self.lower_bounds)
+        self.bound_centroids = self.centroids.copy()
+
+        new_labels = self.labels.copy()
+        if len(candidates) > 0:
+            similarities = self.cal_similarities([self.points[i] for i in candidates])
+            dists = inner_product.to_state_dists(inner_product.to_swap_test_probs(similarities, self.env,
+                                                                                  self.inner_product_mode))
+            new_labels[candidates] = dists.argmin(axis=1)
+            dists.sort(axis=1)
+            self.upper_bounds[candidates] = dists[:, 0]
+            self.lower_bounds[candidates] = dists[:, 1] if self.cluster_num > 1 else np.inf
+        if self.print_detail:
+            print("the number of re-evaluated points: ", len(candidates))
+
+        return new_labels
+
     def update_clusters(self) -> bool:
         """
         updating the clusters based on new centroids
         :return: if there is no change between new and original clusters, return True
         """
-        tmp_points = [point for cluster in self.clusters for point in cluster]
-        new_cluster_id_list = self.find_optimal_cluster(tmp_points)
-
-        index = 0
-        new_clusters = [[] for _ in np.arange(self.cluster_num)]
-        is_terminal = True
-        for i in range(self.cluster_num):
-            for point in self.clusters[i]:
-                new_clusters[new_cluster_id_list[index]].append(point)
-                if new_cluster_id_list[index] != i:
-                    is_terminal = False
-                index += 1
+        if self.capacity is not None:
+            costs = None
+            if self.engine == 'quantum':
+                costs = inner_product.to_state_dists(inner_product.to_swap_test_probs(
+                    self.cal_similarities(self.points), self.env, self.inner_product_mode))
+            new_labels = self.capacitated_assign(costs)
+        elif self.engine == 'classical':
+            new_labels = self.classical_find_optimal_clusters(self.coords)
+        elif self.incremental:
+            new_labels = self.incremental_find_optimal_cluster()
+        else:
+            new_labels = np.asarray(self.find_optimal_cluster(self.points), dtype=np.int64)
 
-        self.clusters = new_clusters
+        is_terminal = bool(np.array_equal(new_labels, self.labels))
+        self.set_labels(new_labels)
         return is_terminal
 
+    def reseed_empty_clusters(self, counts: np.ndarray):
+        """
+        moving the points farthest from their centroids into the empty clusters
+        :param counts: numpy array, the number of points in each cluster
+        """
+        empty_clusters = np.flatnonzero(counts == 0)
+        if len(empty_clusters) == 0:
+            return
+
+        dists = np.abs(self.coords - self.centroids[self.labels]).sum(axis=1)
+        labels = self.labels.copy()
+        for cluster in empty_clusters:
+            # a point is not taken away from a cluster that it is alone in
+            candidates = np.where(counts[labels] > 1, dists, -1)
+            point = int(candidates.argmax())
+            if candidates[point] < 0:
+                break
+            counts[labels[point]] -= 1
+            counts[cluster] += 1
+            labels[point] = cluster
+            dists[point] = -1
+        if self.print_detail:
+            print("reseeding empty clusters: ", empty_clusters)
+        self.set_labels(labels)
+
     def update_centroids(self):
         """
         updating the sites of centroids
         """
-        for i in np.arange(self.cluster_num):
-            tmp_x = 0
-            tmp_y = 0
-            for point in self.clusters[i]:
-                tmp_x += point[0]
-                tmp_y += point[1]
-            self.centroids[i] = [1.0 * tmp_x / len(self.clusters[i]), 1.0 * tmp_y / len(self.clusters[i])]
-            # try:
-            #     self.centroids[i] = [1.0 * tmp_x / len(self.clusters[i]), 1.0 * tmp_y / len(self.clusters[i])]
-            # except ZeroDivisionError:
-            #     print("You are not lucky. Please try again.")
-            #     sys.exit()
+        counts = np.bincount(self.labels, minlength=self.cluster_num)
+        self.reseed_empty_clusters(counts)
+        sums = np.stack((np.bincount(self.labels, weights=self.coords[:, 0], minlength=self.cluster_num),
+                         np.bincount(self.labels, weights=self.coords[:, 1], minlength=self.cluster_num)), axis=1)
+        # the empty clusters left (there are fewer points than clusters) keep their centroids
+        is_filled = counts > 0
+        self.centroids[is_filled] = sums[is_filled] / counts[is_filled, np.newaxis]
+
+    def find_optimal_clusters(self, indices) -> np.ndarray:
+        """
+        finding the optimal cluster of the given points by the engine
+        :param indices: numpy array, the indices of points
+        :return: the cluster of each point
+        """
+        if self.engine == 'classical':
+            return self.classical_find_optimal_clusters(self.coords[indices])
+        return np.asarray(self.find_optimal_cluster(self.coords[indices]), dtype=np.int64)
+
+    def mini_batch_update(self):
+        """
+        assigning a random batch of points and moving the centroids towards them, the learning rate of each
+        cluster is 1 / the number of points assigned to it so far, so that each centroid is the running mean
+        of its assigned points
+        """
+        batch = self.rng.choice(len(self.coords), self.batch_size, replace=False)
+        labels = self.find_optimal_clusters(batch)
+        counts = np.bincount(labels, minlength=self.cluster_num)
+        sums = np.stack((np.bincount(labels, weights=self.coords[batch, 0], minlength=self.cluster_num),
+                         np.bincount(labels, weights=self.coords[batch, 1], minlength=self.cluster_num)), axis=1)
+        self.batch_counts += counts
+        is_hit = counts > 0
+        self.centroids[is_hit] += ((sums[is_hit] - counts[is_hit, np.newaxis] * self.centroids[is_hit]) /
+                                   self.batch_counts[is_hit, np.newaxis])
+
+    def mini_batch_q_means(self):
+        """
+        mini-batch QMeans, each iteration only assigns batch_size points, and all points are assigned batch by batch
+        with the final centroids
+        """
+        point_num = len(self.coords)
+        for i in range(max(self.iter_num, m.ceil(point_num / self.batch_size))):
+            self.mini_batch_update()
+            if self.print_detail:
+                print('-------------------', i, '-th mini-batch Q-means: ------------------------')
+                print("centroids: ", self.centroids)
+
+        # the final pass is split into batches as well, which bounds the size of each assignment
+        batches = np.array_split(np.arange(point_num), m.ceil(point_num / self.batch_size))
+        self.set_labels(np.concatenate([self.find_optimal_clusters(batch) for batch in batches]))
+        if self.print_detail:
+            print("clusters: ", self.clusters)
 
     def q_means(self) -> list:
         """
         the controller that handles the entire process of QMeans
         :return: the final result of QMeans
         """
+        if self.batch_size is not None:
+            self.mini_batch_q_means()
+            return self.get_clusters()
+
         for i in range(self.iter_num):
             if self.print_detail:
                 print('-------------------', i, '-th Q-means: ------------------------')
@@ -246,12 +497,20 @@ class QMeans:
             if self.print_detail:
                 print("centroids: ", self.centroids)
                 print("clusters: ", self.clusters)
+        return self.get_clusters()
 
-        return [SingleCluster(self.centroids[i], self.clusters[i], self.env, self.backend, self.print_detail) for i in
-                range(self.cluster_num)]
+    def get_clusters(self) -> list:
+        """
+        building the clusters of QMeans, the empty clusters are dropped
+        """
+        return [SingleCluster(self.centroids[i].tolist(), self.point_ids[self.clusters[i]], self.dist_matrix, self.env,
+                              self.backend, self.print_detail, inner_product_mode=self.inner_product_mode)
+                for i in range(self.cluster_num) if self.clusters[i]]
 
 
-def divide_clusters(points, cluster_max_size, env, backend, max_qubit_num, print_detail=False) -> list:
+def divide_clusters(points, cluster_max_size, env, backend, max_qubit_num, print_detail=False,
+                    dist_matrix=None, inner_product_mode='circuit', engine='quantum', init_method='k-means++',
+                    seed=None, incremental=False, balanced=False, batch_size=None) -> list:
     """
     dividing points into clusters and ensuring that the size of each cluster is not more than cluster_max_size
     :param points: list, all cities waiting to be clustered
@@ -260,10 +519,23 @@ def divide_clusters(points, cluster_max_size, env, backend, max_qubit_num, print
     :param backend: string, the backend name when running the circuit on real quantum devices
     :param max_qubit_num: int, maximum number of available qubits
     :param print_detail: boolean, whether to print the execution detail
+    :param dist_matrix: DistanceMatrix, the shared coordinate store whose IDs correspond to the order of points
+    :param inner_product_mode: string, how swap tests are evaluated: circuit, analytic or sampled
+    :param engine: string, the assignment method of QMeans: quantum or classical
+    :param init_method: string, the choice of initial centroids: k-means++ or random
+    :param seed: int, the seed of all QMeans runs, which makes the result reproducible
+    :param incremental: boolean, whether the quantum engine only re-evaluates the points whose cluster may change
+    :param balanced: boolean, whether cluster_max_size is enforced as the capacity of clusters in one pass
+    :param batch_size: int, the number of points in each iteration of mini-batch QMeans
     :return: the final result of graph partition module
     """
+    if dist_matrix is None:
+        dist_matrix = DistanceMatrix(points)
+    rng = np.random.default_rng(seed)
     clusters = QMeans(points, m.ceil(len(points) / cluster_max_size), env, backend, max_qubit_num,
-                      print_detail).q_means()
+                      print_detail, dist_matrix=dist_matrix, inner_product_mode=inner_product_mode,
+                      engine=engine, init_method=init_method, seed=rng, incremental=incremental,
+                      capacity=cluster_max_size if balanced else None, batch_size=batch_size).q_means()
     i = 0
     while i < len(clusters):
         if clusters[i].element_num <= cluster_max_size:
@@ -271,8 +543,20 @@ def divide_clusters(points, cluster_max_size, env, backend, max_qubit_num, print
         else:
             if print_detail:
                 print("The following cluster need to be split again: ", clusters[i].elements)
-            clusters[i: i + 1] = QMeans(clusters[i].elements, m.ceil(clusters[i].element_num / cluster_max_size), env,
-                                        backend, max_qubit_num, print_detail).q_means()
+            coords = clusters[i].get_coords()
+            sub_clusters = []
+            if np.ptp(coords, axis=0).any():
+                sub_clusters = QMeans(coords.tolist(), m.ceil(clusters[i].element_num / cluster_max_size), env,
+                                      backend, max_qubit_num, print_detail, clusters[i].elements, dist_matrix,
+                                      inner_product_mode, engine=engine, init_method=init_method,
+                                      seed=rng, incremental=incremental, batch_size=batch_size).q_means()
+            if len(sub_clusters) <= 1:
+                # QMeans cannot separate coincident points, so they are split by index instead
+                sub_clusters = [SingleCluster(None, point_ids, dist_matrix, env, backend, print_detail,
+                                              inner_product_mode=inner_product_mode)
+                                for point_ids in np.array_split(clusters[i].elements,
+                                                                m.ceil(clusters[i].element_num / cluster_max_size))]
+            clusters[i: i + 1] = sub_clusters
 
     if print_detail:
         print("The final result of Q-means: ")
@@ -298,6 +582,17 @@ if __name__ == '__main__':
     parser.add_argument('--max_qubit_num', '-m', type=int, default=15,
                         help='The maximum number of qubits in the backend')
     parser.add_argument('--print_detail', '-p', type=bool, default=False)
+    parser.add_argument('--inner_product_mode', '-ipm', type=str, default='circuit',
+                        help='The evaluation of swap tests, parameter: "circuit"; "analytic"; "sampled"')
+    parser.add_argument('--engine', '-en', type=str, default='quantum',
+                        help='The assignment method of Q-means, parameter: "quantum"; "classical"')
+    parser.add_argument('--seed', type=int, default=None, help='The random seed of Q-means')
+    parser.add_argument('--incremental', '-inc', type=bool, default=False,
+                        help='Only re-evaluate the points whose cluster may change')
+    parser.add_argument('--balanced', '-bl', type=bool, default=False,
+                        help='Enforce the maximum size of clusters during assignment')
+    parser.add_argument('--batch_size', '-bs', type=int, default=None,
+                        help='The number of points in each iteration of mini-batch Q-means')
 
     args = parser.parse_args()
 
@@ -308,7 +603,9 @@ if __name__ == '__main__':
         points.append([float(point[i]) for i in np.arange(len(point))])
 
     clusters = divide_clusters(points, args.cluster_max_size, args.env, args.backend, args.max_qubit_num,
-                               args.print_detail)
+                               args.print_detail, inner_product_mode=args.inner_product_mode, engine=args.engine,
+                               seed=args.seed, incremental=args.incremental, balanced=args.balanced,
+                               batch_size=args.batch_size)
 
     print("The maximum number of points for all clusters: ", max([cluster.element_num for cluster in clusters]))
     print("The minimum number of points for all clusters: ", min([cluster.element_num for cluster in clusters]))
@@ -319,6 +616,6 @@ if __name__ == '__main__':
     colors = plt.cm.rainbow(np.linspace(0, 1, len(clusters)))
     for i, cluster in enumerate(clusters):
         plt.scatter(cluster.centroid[0], cluster.centroid[1], color=colors[i], s=30, marker='x')
-        for point in cluster.elements:
+        for point in cluster.get_coords():
             plt.scatter(point[0], point[1], color=colors[i], s=5)
     plt.show()
@@ -1,11 +1,15 @@
 import argparse
+import json
 import sys
 import os
-import random
 import math as m
 import numpy as np
+from scipy import sparse
+from scipy.optimize import minimize
 
 from qiskit import QuantumRegister, QuantumCircuit, ClassicalRegister
+from qiskit.circuit import ParameterVector
+from qiskit.quantum_info import Statevector
 from qiskit_aer import AerSimulator
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -14,34 +18,98 @@ sys.path.insert(0, parent_dir_path)
 import clustering.cut_preparation as prep
 from utils import execute, read_dataset
 from entity.single_cluster import SingleCluster
+from utils.distance import DistanceMatrix
 
 
 # from dataset import test
 
+# sampled: estimating the expectation from the measured bitstrings; statevector: the exact expectation
+EXPECTATION_MODES = ('sampled', 'statevector')
+# gradient_descent: descending along the estimated gradient; spsa: descending along a random direction, which only
+# needs two evaluations per step; cobyla and nelder-mead: the derivative-free methods of scipy
+OPTIMIZERS = ('gradient_descent', 'spsa', 'cobyla', 'nelder-mead')
+SCIPY_METHODS = {'cobyla': 'COBYLA', 'nelder-mead': 'Nelder-Mead'}
+# the width of buckets when the statistics of affinities are used as the key of AngleCache
+AFFINITY_BUCKET = 0.1
+# the largest sum of differences in the mean and the standard deviation of affinities between a subgraph and
+# the cached one that the cached theta still warm-starts
+WARM_START_TOLERANCE = 2 * AFFINITY_BUCKET
+
+
+class EnergyPlateau(Exception):
+    """
+    raised when the minimum energy has not decreased for the patience steps
+    """
+
 
 class QAOACut:
-    def __init__(self, points: list, theta: list, lamda: float, norm_threshold: float):
+    def __init__(self, points: list, theta: list, lamda: float, norm_threshold: float, neighbor_num=None,
+                 expectation_mode='sampled', optimizer='gradient_descent', callback=None, seed=None):
         """
         :param points: list, all cities in TSP
         :param theta: list, parameters of QAOA
         :param lamda: int, the parameter in the cost function of QNCut
         :param norm_threshold: float, the threshold when the degree matrix is normalized
+        :param neighbor_num: int, only the edges between each point and its nearest neighbor_num points are weighted
+        :param expectation_mode: string, how the expectation of energy is evaluated: sampled or statevector
+        :param optimizer: string, one of OPTIMIZERS
+        :param callback: function, called as callback(step, theta, energy) after each evaluation of training
+        :param seed: int or numpy Generator, the source of the random directions of SPSA, which is shared when
+                     a Generator is given
         """
+        if expectation_mode not in EXPECTATION_MODES:
+            raise ValueError(f"Unknown expectation mode: {expectation_mode}, the options are {list(EXPECTATION_MODES)}")
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f"Unknown optimizer: {optimizer}, the options are {list(OPTIMIZERS)}")
         self.points = points
         self.point_num = len(self.points)
-        self.adj_matrix = prep.build_adj_matrix(self.points, self.point_num)
+        self.adj_matrix = prep.build_adj_matrix(self.points, self.point_num, neighbor_num=neighbor_num)
+        if sparse.issparse(self.adj_matrix):
+            self.adj_matrix = self.adj_matrix.toarray()
         deg_matrix = prep.build_deg_matrix(self.adj_matrix, self.point_num)
         self.deg_matrix = prep.scaling_up_deg_matrix(deg_matrix, self.point_num)
         self.norm_deg_matrix = prep.scaling_down_deg_matrix(deg_matrix, norm_threshold, self.point_num)
-
-        self.theta = theta
+        # the weights of edges (i, j) with i < j, and the degrees as numpy arrays for cal_energies
+        self.upper_adj = np.triu(self.adj_matrix, 1)
+        self.deg_array = np.asarray(self.deg_matrix, dtype=np.float64)
+        self.expectation_mode = expectation_mode
+        # the energy of each computational basis state, which is built for the statevector mode
+        self.basis_energies = None
+
+        # the QAOA circuit whose theta are parameters, which is built and transpiled once
+        self.template = None
+        self.template_params = None
+        self.trans_template = None
+
+        self.optimizer = optimizer
+        self.callback = callback
+        self.rng = np.random.default_rng(seed)
+
+        # theta is updated in place, so the given list is copied
+        self.theta = list(theta)
         self.lamda = lamda
-        self.min_theta = self.theta
+        self.min_theta = list(self.theta)
+        self.min_energy = m.inf
 
         self.precision = 6
         self.step = 0.01
         self.epsilon = 0.001
         self.delta = 0.001
+        self.shots = 20000
+        self.max_step_num = 100
+        # the training stops when the minimum energy has not decreased by delta for patience steps
+        self.patience = 20
+        # the patience and the initial step of scipy methods when theta is warm-started from a similar subgraph
+        self.warm_patience = 8
+        self.warm_radius = 0.25
+        self.trust_radius = None
+        self.plateau_num = 0
+        self.step_num = 0
+        # the gains of SPSA, whose step size is spsa_a / (k + 1 + spsa_stability) ^ 0.602 and perturbation is
+        # spsa_c / (k + 1) ^ 0.101 in the k-th step
+        self.spsa_a = 0.1
+        self.spsa_c = 0.1
+        self.spsa_stability = 10
 
     def phase_gate_simple(self, gamma: float) -> QuantumCircuit:
         """
@@ -54,6 +122,9 @@ class QAOACut:
         # The cost of cut
         for i in range(self.point_num):
             for j in range(i + 1, self.point_num):
+                # the edges without weight are identities
+                if self.adj_matrix[i][j] == 0:
+                    continue
                 qc.cx(qram[i], qram[j])
                 qc.rz(gamma * self.adj_matrix[i][j], qram[j])
                 qc.cx(qram[i], qram[j])
@@ -78,6 +149,9 @@ class QAOACut:
         # The cost of cut
         for i in range(self.point_num):
             for j in range(i + 1, self.point_num):
+                # the edges without weight are identities
+                if self.adj_matrix[i][j] == 0:
+                    continue
                 qc.cx(qram[i], qram[j])
                 qc.rz(gamma * self.adj_matrix[i][j], qram[j])
                 qc.cx(qram[i], qram[j])
@@ -133,10 +207,12 @@ class QAOACut:
 
         return qc
 
-    def qaoa(self) -> QuantumCircuit:
+    def qaoa(self, theta=None) -> QuantumCircuit:
         """
         the complete version of QAOA
+        :param theta: list or ParameterVector, self.theta by default
         """
+        theta = self.theta if theta is None else theta
         qram = QuantumRegister(self.point_num)
         eigen_vec = QuantumRegister(1)
         eigen_val = QuantumRegister(self.precision)
@@ -144,9 +220,9 @@ class QAOACut:
         cl = ClassicalRegister(self.point_num)
         qc = QuantumCircuit(qram, eigen_vec, eigen_val, anc, cl)
 
-        p = len(self.theta) // 2
-        gamma = self.theta[:p]
-        beta = self.theta[p:]
+        p = len(theta) // 2
+        gamma = theta[:p]
+        beta = theta[p:]
 
         qc.h(qram)
         for i in range(p):
@@ -157,98 +233,336 @@ class QAOACut:
 
         return qc
 
+    def cal_energies(self, states: np.ndarray) -> np.ndarray:
+        """
+        calculating the total energies of many measurement results at once
+        :param states: numpy array with the shape of (m, point_num), whose i-th column is the side of the i-th point
+        :return: numpy array, the energy of each measurement result
+        """
+        states = np.asarray(states, dtype=np.float64)
+        # the edge (i, j) is cut when x_i + x_j - 2 * x_i * x_j is 1
+        energies = 0.5 * (states @ (self.upper_adj.sum(axis=1) + self.upper_adj.sum(axis=0)) -
+                          2 * ((states @ self.upper_adj) * states).sum(axis=1))
+
+        # constraint, the degrees of side 0 minus the degrees of side 1
+        constraint = self.deg_array.sum() - 2 * states @ self.deg_array
+        return energies + self.lamda * np.abs(constraint)
+
     def cal_energy(self, state: str) -> float:
         """
         calculating the total energy of the quantum system represented by measurement results
         :param state: the measurement results of the quantum system
         :return: the total energy
         """
-        energy = 0
-        for i in range(self.point_num):
-            for j in range(i + 1, self.point_num):
-                if state[i] != state[j]:
-                    energy += 0.5 * self.adj_matrix[i][j]
-
-        # constraint
-        constraint = 0.
-        for k in range(self.point_num):
-            if state[k] == '0':
-                constraint += self.deg_matrix[k]
-            else:
-                constraint -= self.deg_matrix[k]
-        energy += self.lamda * abs(constraint)
+        return float(self.cal_energies(np.array([[bit == '1' for bit in state]]))[0])
 
-        return energy
+    def get_basis_energies(self) -> np.ndarray:
+        """
+        the energy of each computational basis state of qram, the i-th point is the i-th lowest bit of index
+        """
+        if self.basis_energies is None:
+            indices = np.arange(2 ** self.point_num)
+            self.basis_energies = self.cal_energies((indices[:, np.newaxis] >> np.arange(self.point_num)) & 1)
+        return self.basis_energies
 
     def expectation_value(self, qc: QuantumCircuit, shots: int = 20000) -> float:
         """
         calculating the expectation value of the entire quantum system
         :param qc: quantum circuit
-        :param shots: int, the shots times
+        :param shots: int, the shots times, which are not used in the statevector mode
         """
+        if self.expectation_mode == 'statevector':
+            probs = Statevector(qc.remove_final_measurements(inplace=False)).probabilities(list(range(self.point_num)))
+            return round(float(probs @ self.get_basis_energies()), 4)
+
         job = execute.exec_qcircuit(qc, shots, 'sim', False, None, False)
-        output = execute.get_output(job, 'sim')
-
-        energy = 0
-        for item in output.items():
-            tmp_key = item[0][::-1]
-            tmp_val = item[1]
-            # 此处在真机上处理时，不需要除以shots，得到的本身就是概率
-            energy += self.cal_energy(tmp_key) * (tmp_val / shots)
-        energy = round(energy, 4)
+        return self.cal_expectation(execute.get_output(job, 'sim'), shots)
+
+    def cal_expectation(self, output: dict, shots: int) -> float:
+        """
+        calculating the expectation value from the counts of measurement results
+        :param output: dict, the counts of bitstrings
+        :param shots: int, the shots times
+        """
+        # the bitstrings are reversed so that the i-th column is the i-th qubit
+        keys = ''.join(key[::-1] for key in output.keys())
+        states = (np.frombuffer(keys.encode(), dtype=np.uint8) == ord('1')).reshape(len(output), self.point_num)
+        # 此处在真机上处理时，不需要除以shots，得到的本身就是概率
+        probs = np.fromiter(output.values(), dtype=np.float64, count=len(output)) / shots
+        energy = round(float(probs @ self.cal_energies(states)), 4)
         return energy
 
+    def get_template(self) -> tuple[QuantumCircuit, ParameterVector]:
+        """
+        building and transpiling the parameterized QAOA circuit at the first call
+        :return: the transpiled circuit and its parameters
+        """
+        if self.template is None:
+            self.template_params = ParameterVector('theta', len(self.theta))
+            self.template = self.qaoa(self.template_params)
+            self.trans_template = execute.transpile_qcircuit(self.template, 'sim', False, None)
+        return self.trans_template, self.template_params
+
+    def expectation_values(self, thetas: list) -> list:
+        """
+        calculating the expectation values of many parameter sets, which are bound to the same transpiled circuit and
+        submitted as one job
+        :param thetas: list, the parameter sets of QAOA
+        """
+        trans_template, params = self.get_template()
+        if self.expectation_mode == 'statevector':
+            template = self.template.remove_final_measurements(inplace=False)
+            return [self.expectation_value(template.assign_parameters(dict(zip(params, theta)))) for theta in thetas]
+
+        qcs = [execute.bind_parameters(trans_template, params, theta) for theta in thetas]
+        job = execute.run_qcircuits(qcs, self.shots, 'sim', False, None)
+        return [self.cal_expectation(output, self.shots) for output in execute.get_outputs(job, 'sim')]
+
     def gradient_descent(self):
         """
-        optimizing the parameters of QAOA
+        optimizing the parameters of QAOA, all shifted parameter sets are evaluated in one job
         """
-        energies = []
+        thetas = []
         for i in range(len(self.theta)):
-            self.theta[i] += self.epsilon
-            qc = self.qaoa()
-            energies.append(self.expectation_value(qc))
-            self.theta[i] -= 2 * self.epsilon
-            qc = self.qaoa()
-            energies.append(self.expectation_value(qc))
-            self.theta[i] += self.epsilon
+            for sign in (1, -1):
+                theta = list(self.theta)
+                theta[i] += sign * self.epsilon
+                thetas.append(theta)
+        energies = self.expectation_values(thetas)
         for i in range(len(self.theta)):
             self.theta[i] -= (energies[i * 2] - energies[i * 2 + 1]) / (2.0 * self.epsilon) * self.step
 
-    def main(self):
+    def warm_start(self, theta: list):
         """
-        the controller that handles the entire process of QNCut
+        starting the training from the theta trained on a similar subgraph, which is only refined locally
+        """
+        self.theta = list(theta)
+        self.min_theta = list(theta)
+        self.patience = self.warm_patience
+        self.trust_radius = self.warm_radius
+
+    def spsa_step(self):
+        """
+        optimizing the parameters of QAOA by SPSA, the gradient is estimated along a random direction
+        """
+        k = self.step_num - 1
+        step = self.spsa_a / (k + 1 + self.spsa_stability) ** 0.602
+        perturbation = self.spsa_c / (k + 1) ** 0.101
+        direction = self.rng.choice((-1, 1), len(self.theta))
+        theta = np.array(self.theta)
+        energy_plus, energy_minus = self.expectation_values([(theta + perturbation * direction).tolist(),
+                                                             (theta - perturbation * direction).tolist()])
+        self.theta = (theta - step * (energy_plus - energy_minus) / (2 * perturbation) * direction).tolist()
+
+    def record(self, theta: list, energy: float):
+        """
+        recording the energy of an evaluated theta, and raising EnergyPlateau when the energy stops decreasing
+        """
+        self.step_num += 1
+        if energy < self.min_energy - self.delta:
+            self.plateau_num = 0
+        else:
+            self.plateau_num += 1
+        if energy < self.min_energy:
+            self.min_energy = energy
+            self.min_theta = list(theta)
+        print(self.step_num, '-th step, F: ', energy, ' theta: ', theta)
+        if self.callback is not None:
+            self.callback(self.step_num, list(theta), energy)
+        if self.plateau_num >= self.patience:
+            raise EnergyPlateau()
+
+    def iterative_optimize(self):
+        """
+        training theta by gradient descent or SPSA
         """
         energy = 100
         energy_old = 1000
-        energy_min = 1000
-
-        s = 0
-        while s < 100 and abs(energy - energy_old) > self.delta:
-            if s > 0:
+        while self.step_num < self.max_step_num and abs(energy - energy_old) > self.delta:
+            if self.step_num > 0:
                 # optimize theta
-                self.gradient_descent()
-            qc = self.qaoa()
+                if self.optimizer == 'spsa':
+                    self.spsa_step()
+                else:
+                    self.gradient_descent()
 
             energy_old = energy
-            energy = self.expectation_value(qc)
-            if energy < energy_min:
-                energy_min = energy
-                self.min_theta = self.theta
-            s += 1
-            print(s, '-th step, F: ', energy, ' theta: ', self.theta)
+            energy = self.expectation_values([self.theta])[0]
+            self.record(self.theta, energy)
 
             # reduce the step size
             if self.step > 0.001:
                 self.step *= 0.9
 
+    def scipy_optimize(self):
+        """
+        training theta by the derivative-free methods of scipy, each evaluation is regarded as a step
+        """
+        def objective(theta):
+            energy = self.expectation_values([theta.tolist()])[0]
+            self.record(theta.tolist(), energy)
+            return energy
+
+        options = {'maxiter': self.max_step_num} if self.optimizer == 'cobyla' else {'maxfev': self.max_step_num}
+        if self.trust_radius is not None:
+            if self.optimizer == 'cobyla':
+                options['rhobeg'] = self.trust_radius
+            else:
+                options['initial_simplex'] = np.vstack((self.theta, self.theta + self.trust_radius *
+                                                        np.eye(len(self.theta))))
+        result = minimize(objective, np.array(self.theta), method=SCIPY_METHODS[self.optimizer], options=options)
+        self.theta = result.x.tolist()
+
+    def main(self):
+        """
+        the controller that handles the entire process of QNCut
+        """
+        try:
+            if self.optimizer in SCIPY_METHODS:
+                self.scipy_optimize()
+            else:
+                self.iterative_optimize()
+        except EnergyPlateau:
+            print(f"The energy has not decreased for {self.patience} steps")
+
 
-def execute_qncut(points, theta, lamda, norm_threshold, env, backend, print_detail):
-    cut = QAOACut(points, theta, lamda, norm_threshold)
+class AngleCache:
+    def __init__(self, path=None):
+        """
+        the trained theta of QAOA, keyed by the size of subgraph and the statistics of its normalized affinities,
+        which seeds the training of similar subgraphs
+        :param path: string, the JSON file that the cache is loaded from and saved to, the cache is kept in memory only
+                     by default
+        """
+        self.path = path
+        # key -> {'point_num', 'lamda', 'mean', 'std', 'theta', 'energy'}
+        self.entries = dict()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def get_stats(cut: QAOACut) -> tuple[float, float]:
+        """
+        the mean and the standard deviation of the affinities in [0, 1] between all pairs of points, in buckets
+        """
+        affinities = cut.upper_adj[np.triu_indices(cut.point_num, 1)] / 10
+        if len(affinities) == 0:
+            return 0., 0.
+        return (round(float(affinities.mean()) / AFFINITY_BUCKET) * AFFINITY_BUCKET,
+                round(float(affinities.std()) / AFFINITY_BUCKET) * AFFINITY_BUCKET)
+
+    def get_key(self, cut: QAOACut) -> str:
+        mean, std = self.get_stats(cut)
+        # lamda is an int from divide_clusters but a float from the command line
+        return f"{cut.point_num}_{float(cut.lamda)}_{mean:.2f}_{std:.2f}"
+
+    def get(self, cut: QAOACut):
+        """
+        getting the theta trained on the most similar subgraph with the same size and lamda, whose statistics of
+        affinities are within WARM_START_TOLERANCE
+        :return: list, or None if there is no such subgraph
+        """
+        key = self.get_key(cut)
+        if key not in self.entries:
+            mean, std = self.get_stats(cut)
+            dists = {k: abs(entry['mean'] - mean) + abs(entry['std'] - std) for k, entry in self.entries.items()
+                     if entry['point_num'] == cut.point_num and float(entry['lamda']) == float(cut.lamda)}
+            key = min(dists, key=dists.get, default=None)
+            if key is None or dists[key] > WARM_START_TOLERANCE + 1e-9:
+                self.misses += 1
+                return None
+        self.hits += 1
+        return list(self.entries[key]['theta'])
+
+    def seed(self, cut: QAOACut):
+        """
+        replacing the initial theta of cut with the cached one if there is one
+        """
+        cached_theta = self.get(cut)
+        if cached_theta is not None:
+            cut.warm_start(cached_theta)
+
+    def put(self, cut: QAOACut):
+        """
+        writing back the trained theta of cut, which replaces the cached one if its energy is lower
+        """
+        if cut.min_energy == m.inf:
+            return
+        key = self.get_key(cut)
+        if key in self.entries and self.entries[key]['energy'] <= cut.min_energy:
+            return
+        mean, std = self.get_stats(cut)
+        self.entries[key] = {'point_num': cut.point_num, 'lamda': float(cut.lamda), 'mean': mean, 'std': std,
+                             'theta': [float(angle) for angle in cut.min_theta], 'energy': float(cut.min_energy)}
+
+    def save(self):
+        """
+        saving the cache to path, the file is replaced at once so that it is never left half written
+        """
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def balance_bipartition(coords: np.ndarray, is_second: np.ndarray, target_size: int) -> np.ndarray:
+    """
+    moving the points across the cut until one side has target_size points, the moved points are those
+    whose distance to the centroid of the other side exceeds the distance to their own by the least
+    :param coords: numpy array with the shape of (n, 2)
+    :param is_second: numpy array of boolean, whether each point is on the second side
+    :param target_size: int, the size of one side
+    :return: the sides of points after balancing
+    """
+    is_second = is_second.copy()
+    point_num = len(coords)
+    # the side closer to target_size is regarded as the side of target_size
+    if abs((point_num - is_second.sum()) - target_size) > abs(is_second.sum() - target_size):
+        is_second = ~is_second
+    surplus = int((point_num - is_second.sum()) - target_size)
+    if surplus == 0:
+        return is_second
+
+    # moving points from the first side when surplus > 0, otherwise from the second side
+    from_side = is_second if surplus < 0 else ~is_second
+    if from_side.all():
+        # all points are on one side, so the other side starts from the farthest point of its centroid
+        centroid = coords.mean(axis=0)
+        moving_cost = -np.abs(coords - centroid).sum(axis=1)
+    else:
+        own_centroid = coords[from_side].mean(axis=0)
+        other_centroid = coords[~from_side].mean(axis=0)
+        moving_cost = np.abs(coords - other_centroid).sum(axis=1) - np.abs(coords - own_centroid).sum(axis=1)
+    candidates = np.flatnonzero(from_side)
+    moved = candidates[np.argsort(moving_cost[candidates], kind='stable')[:abs(surplus)]]
+    is_second[moved] = ~is_second[moved]
+    return is_second
+
+
+def execute_qncut(points, theta, lamda, norm_threshold, env, backend, print_detail, point_ids, dist_matrix,
+                  inner_product_mode='circuit', target_size=None, neighbor_num=None, expectation_mode='sampled',
+                  optimizer='gradient_descent', callback=None, angle_cache=None, seed=None) -> tuple[list, list]:
+    """
+    bisecting the points by QNCut
+    :param angle_cache: AngleCache, the training starts from the cached theta of a similar subgraph if there is one,
+                        and the trained theta is written back
+    :param seed: int or numpy Generator, the source of the random directions of SPSA
+    :return: the two clusters and the trained theta
+    """
+    cut = QAOACut(points, theta, lamda, norm_threshold, neighbor_num, expectation_mode, optimizer, callback, seed)
+    if angle_cache is not None:
+        angle_cache.seed(cut)
     cut.main()
+    if angle_cache is not None:
+        angle_cache.put(cut)
 
     # getting the optimal outputs
-    result_cut = QAOACut(points, cut.min_theta, lamda, norm_threshold)
-    qc = result_cut.qaoa()
+    qc = cut.qaoa(cut.min_theta)
     job = execute.exec_qcircuit(qc, 20000, env, False, backend, print_detail)
     output = execute.get_output(job, env)
 
@@ -256,32 +570,84 @@ def execute_qncut(points, theta, lamda, norm_threshold, env, backend, print_deta
     max_num = 0
     max_output = ""
     for item in output.items():
+        if target_size is not None and item[0].count('0') not in (target_size, len(points) - target_size):
+            continue
+        # the cut leaving one side empty does not divide the points
+        if len(set(item[0])) < 2:
+            continue
         if item[1] > max_num:
             max_num = item[1]
             max_output = item[0]
 
+    if not max_output:
+        # no sampled cut has the target size (or half of the points if not given), so the most probable cut
+        # is balanced
+        max_output = max(output.items(), key=lambda item: item[1])[0]
+        is_second = balance_bipartition(np.asarray(points, dtype=np.float64),
+                                        np.array([bit == '1' for bit in max_output]),
+                                        target_size if target_size is not None else len(points) // 2)
+        max_output = ''.join('1' if side else '0' for side in is_second)
+
     if print_detail:
         print("max_output: ", max_output)
 
     clusters = [[], []]
     for i in range(len(max_output)):
         if max_output[i] == '0':
-            clusters[0].append(points[i])
+            clusters[0].append(point_ids[i])
         else:
-            clusters[1].append(points[i])
-
-    return [SingleCluster(None, clusters[i], env, backend, print_detail) for i in range(len(clusters))]
-
-
-def random_theta(theta_num=4):
-    theta = list()
-    for _ in range(theta_num):
-        theta.append(2 * m.pi * random.random())
-    return theta
-
-
-def divide_clusters(points, env, backend, print_detail, cluster_max_size, lamda=6, norm_threshold=0.25):
-    clusters = execute_qncut(points, random_theta(), lamda, norm_threshold, env, backend, print_detail)
+            clusters[1].append(point_ids[i])
+
+    return [SingleCluster(None, clusters[i], dist_matrix, env, backend, print_detail,
+                          inner_product_mode=inner_product_mode) for i in range(len(clusters))], cut.min_theta
+
+
+def random_theta(theta_num=4, rng=None):
+    rng = np.random.default_rng(rng)
+    return (2 * m.pi * rng.random(theta_num)).tolist()
+
+
+def get_target_size(point_num, cluster_max_size) -> int:
+    """
+    the size of one side when the points are bisected for the balanced partition, so that both sides can be
+    divided into the clusters of at most cluster_max_size in proportion
+    """
+    part_num = m.ceil(point_num / cluster_max_size)
+    return round(point_num * (part_num // 2) / part_num)
+
+
+def divide_clusters(points, env, backend, print_detail, cluster_max_size, lamda=6, norm_threshold=0.25,
+                    dist_matrix=None, inner_product_mode='circuit', balanced=False, neighbor_num=None,
+                    expectation_mode='sampled', optimizer='gradient_descent', warm_start=False, callback=None,
+                    angle_cache=None, seed=None):
+    """
+    dividing points into clusters by QNCut and ensuring that the size of each cluster is not more than
+    cluster_max_size
+    :param balanced: boolean, whether every bisection is restricted to the sizes in proportion to
+                     the number of final clusters, which makes the number of bisections fixed
+    :param neighbor_num: int, the number of nearest neighbors of each point in the sparse affinity graph,
+                         all pairs of points are weighted by default
+    :param expectation_mode: string, how QAOA evaluates the expectation of energy: sampled or statevector
+    :param optimizer: string, the optimizer of QAOA, one of OPTIMIZERS
+    :param warm_start: boolean, whether each bisection starts from the theta trained in the previous one instead of
+                       random theta
+    :param callback: function, called as callback(step, theta, energy) in the training of each bisection
+    :param angle_cache: AngleCache or string, the cache of trained theta or the path of its file, which takes precedence
+                        over warm_start and is saved at the end
+    :param seed: int, the seed of the random theta and the SPSA directions of all bisections
+    """
+    rng = np.random.default_rng(seed)
+    if isinstance(angle_cache, str):
+        angle_cache = AngleCache(angle_cache)
+    if dist_matrix is None:
+        dist_matrix = DistanceMatrix(points)
+    if balanced and len(points) <= cluster_max_size:
+        return [SingleCluster(None, np.arange(len(points)), dist_matrix, env, backend, print_detail,
+                              inner_product_mode=inner_product_mode)]
+    clusters, theta = execute_qncut(points, random_theta(rng=rng), lamda, norm_threshold, env, backend, print_detail,
+                                    np.arange(len(points)), dist_matrix, inner_product_mode,
+                                    get_target_size(len(points), cluster_max_size) if balanced else None,
+                                    neighbor_num, expectation_mode, optimizer, callback, angle_cache, rng)
 
     i = 0
     while i < len(clusters):
@@ -290,8 +656,18 @@ def divide_clusters(points, env, backend, print_detail, cluster_max_size, lamda=
         else:
             if print_detail:
                 print(f"The {i}-th cluster needs to be partitioned again")
-            clusters[i: i + 1] = execute_qncut(clusters[i].elements, random_theta(), lamda, norm_threshold, env,
-                                               backend, print_detail)
+            target_size = get_target_size(clusters[i].element_num, cluster_max_size) if balanced else None
+            clusters[i: i + 1], trained_theta = execute_qncut(clusters[i].get_coords().tolist(),
+                                                              theta if warm_start else random_theta(rng=rng), lamda,
+                                                              norm_threshold, env, backend, print_detail,
+                                                              clusters[i].elements, dist_matrix, inner_product_mode,
+                                                              target_size, neighbor_num, expectation_mode,
+                                                              optimizer, callback, angle_cache, rng)
+            if warm_start:
+                theta = trained_theta
+
+    if angle_cache is not None:
+        angle_cache.save()
 
     # calculating the centroid of each cluster
     for cluster in clusters:
@@ -312,6 +688,15 @@ if __name__ == '__main__':
     parser.add_argument('--lamda', '-l', type=float, default=6, help='The parameter in QNCut\'s cost function')
     parser.add_argument('--norm_threshold', '-n', type=float, default=0.25,
                         help='the threshold in degree matrix normalization')
+    parser.add_argument('--neighbor_num', '-nn', type=int, default=None,
+                        help='The number of nearest neighbors in the sparse affinity graph')
+    parser.add_argument('--expectation_mode', '-em', type=str, default='sampled',
+                        help='The evaluation of QAOA energy, parameter: "sampled"; "statevector"')
+    parser.add_argument('--optimizer', '-op', type=str, default='gradient_descent',
+                        help='The optimizer of QAOA, parameter: "gradient_descent"; "spsa"; "cobyla"; "nelder-mead"')
+    parser.add_argument('--angle_cache', '-ac', type=str, default=None,
+                        help='The JSON file of trained QAOA parameters, which is reused between runs')
+    parser.add_argument('--seed', type=int, default=None, help='The random seed of theta and SPSA')
 
     args = parser.parse_args()
 
@@ -321,13 +706,19 @@ if __name__ == '__main__':
         point = line.strip().split(' ')[1:]
         points.append([float(point[i]) for i in np.arange(len(point))])
 
-    theta = list()
-    for _ in range(4):
-        theta.append(2 * m.pi * random.random())
+    rng = np.random.default_rng(args.seed)
+    theta = random_theta(rng=rng)
     # lamda = 6
     # max_sum = 0.25
 
-    cut = QAOACut(points, theta, args.lamda, args.norm_threshold)
+    cut = QAOACut(points, theta, args.lamda, args.norm_threshold, args.neighbor_num, args.expectation_mode,
+                  args.optimizer, seed=rng)
+    angle_cache = AngleCache(args.angle_cache) if args.angle_cache is not None else None
+    if angle_cache is not None:
+        angle_cache.seed(cut)
     cut.main()
+    if angle_cache is not None:
+        angle_cache.put(cut)
+        angle_cache.save()
     print("min_theta: ", cut.min_theta)
     print("theta: ", cut.theta)
@@ -11,7 +11,8 @@ from utils import util
 
 
 class BaseCluster:
-    def __init__(self, centroid, element_num, elements, class_type, env, backend, print_detail=False):
+    def __init__(self, centroid, element_num, elements, class_type, env, backend, print_detail=False,
+                 solver='held_karp', dist_matrix=None):
         self.head = None
         self.tail = None
         self.centroid = centroid
@@ -22,6 +23,10 @@ class BaseCluster:
         self.env = env
         self.backend = backend
         self.print_detail = print_detail
+        # the exact solver of the subproblem, see utils.path_solver.SOLVERS
+        self.solver = solver
+        # the shared utils.distance.DistanceMatrix of all cities
+        self.dist_matrix = dist_matrix
 
     def determine_head_and_tail(self):
         if self.element_num == 1:
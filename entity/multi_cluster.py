@@ -5,12 +5,13 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 parent_dir_path = os.path.abspath(os.path.join(dir_path, os.pardir))
 sys.path.insert(0, parent_dir_path)
 from entity.base_cluster import BaseCluster
-from utils import util
+from utils import util, path_solver
 
 
 class MultiCluster(BaseCluster):
-    def __init__(self, centroid, clusters, env, backend, print_detail=False):
-        super(MultiCluster, self).__init__(centroid, len(clusters), clusters, 'Multi', env, backend, print_detail)
+    def __init__(self, centroid, clusters, env, backend, print_detail=False, solver='held_karp'):
+        super(MultiCluster, self).__init__(centroid, len(clusters), clusters, 'Multi', env, backend, print_detail,
+                                           solver)
         self.point_num = sum(cluster.get_point_num() for cluster in clusters)
 
     def get_nodes_in_path(self):
@@ -22,11 +23,7 @@ class MultiCluster(BaseCluster):
         self.circle_to_path()
 
     def find_optimal_path(self, total_qubit_num):
-        cur_path = [0]
-        opt_path = [0 for _ in range(self.element_num)]
-        min_len = 100000
-        is_chosen = [False for _ in range(self.element_num)]
-        util.find_optimal_path(self.get_nodes_in_path(), cur_path, 0, opt_path, min_len, is_chosen)
+        opt_path, _ = path_solver.solve(util.cal_dist_matrix(self.get_nodes_in_path()), self.solver)
         self.reorder(opt_path)
 
     def get_point_num(self):
@@ -1,5 +1,6 @@
 import sys
 import os
+import numpy as np
 
 from scipy.spatial import ConvexHull, QhullError
 
@@ -7,25 +8,73 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 parent_dir_path = os.path.abspath(os.path.join(dir_path, os.pardir))
 sys.path.insert(0, parent_dir_path)
 from entity.base_cluster import BaseCluster
-from utils import util
-from QCHSA.qchsa_main import ConvexHull as QCH
+from utils import path_solver
+from QCHSA.qchsa_main import ConvexHull as QCH, monotone_chain
+
+# monotone_chain and qhull are classical, qchsa runs the swap tests of QCHSA
+HULL_ENGINES = ('monotone_chain', 'qhull', 'qchsa')
 
 
 class SingleCluster(BaseCluster):
-    def __init__(self, centroid, points, env, backend, print_detail=False):
-        super(SingleCluster, self).__init__(centroid, len(points), points, 'Single', env, backend, print_detail)
-        self.convex_hull = []
-        self.find_convex_hull()
+    def __init__(self, centroid, point_ids, dist_matrix, env, backend, print_detail=False, solver='held_karp',
+                 inner_product_mode='circuit', hull_engine='monotone_chain', max_qubit_num=None):
+        """
+        :param centroid: list, the centroid of cluster
+        :param point_ids: list or numpy array, IDs of the points in cluster
+        :param dist_matrix: DistanceMatrix, the shared coordinate store and distances of all cities
+        :param inner_product_mode: string, how the swap tests of QCHSA are evaluated: circuit, analytic or sampled
+        :param hull_engine: string, the method finding the convex hull, one of HULL_ENGINES
+        :param max_qubit_num: int, maximum number of available qubits for QCHSA
+        """
+        super(SingleCluster, self).__init__(centroid, len(point_ids), np.asarray(point_ids, dtype=np.int32),
+                                            'Single', env, backend, print_detail, solver, dist_matrix)
+        self.inner_product_mode = inner_product_mode
+        self.hull_engine = None
+        self.max_qubit_num = None
+        # the convex hull is found when it is needed for the first time
+        self.convex_hull = None
+        self.set_hull_engine(hull_engine, max_qubit_num)
+
+    def set_hull_engine(self, hull_engine, max_qubit_num=None):
+        """
+        choosing the method finding the convex hull, the hull found before is dropped
+        :param hull_engine: string, one of HULL_ENGINES
+        :param max_qubit_num: int, maximum number of available qubits for QCHSA
+        """
+        if hull_engine not in HULL_ENGINES:
+            raise ValueError(f"Unknown hull engine: {hull_engine}, the options are {list(HULL_ENGINES)}")
+        self.hull_engine = hull_engine
+        self.max_qubit_num = max_qubit_num
+        self.convex_hull = None
+
+    def get_coords(self) -> np.ndarray:
+        """
+        the coordinates of points in the current order, with the shape of (n, 2)
+        """
+        return self.dist_matrix.coords[self.elements]
 
     def calculate_centroid(self):
-        x_sum, y_sum = 0, 0
-        for e in self.elements:
-            x_sum += e[0]
-            y_sum += e[1]
-        self.centroid = [x_sum / self.element_num, y_sum / self.element_num]
+        self.centroid = self.get_coords().mean(axis=0).tolist()
 
     def get_nodes_in_path(self):
-        return self.elements
+        return self.get_coords()
+
+    def determine_head_and_tail(self):
+        if self.element_num == 1:
+            return
+        others = self.elements[(self.elements != self.head) & (self.elements != self.tail)]
+        self.elements = np.concatenate(([self.head], others, [self.tail])).astype(np.int32)
+
+    def reorder(self, path):
+        self.elements = self.elements[path]
+
+    def path_to_circle(self):
+        self.element_num += 1
+        self.elements = np.append(self.elements, self.elements[0])
+
+    def circle_to_path(self):
+        self.element_num -= 1
+        self.elements = self.elements[:-1]
 
     def find_optimal_circle(self, total_qubit_num):
         self.path_to_circle()
@@ -36,11 +85,7 @@ class SingleCluster(BaseCluster):
         # path = OptimalPath(self.point_num, self.points, total_qubit_num).main()
         # self.reorder(path)
 
-        cur_path = [0]
-        opt_path = [0 for _ in range(self.element_num)]
-        min_len = 100000
-        is_chosen = [False for _ in range(self.element_num)]
-        util.find_optimal_path(self.elements, cur_path, 0, opt_path, min_len, is_chosen)
+        opt_path, _ = path_solver.solve(self.dist_matrix.sub_matrix(self.elements), self.solver)
         self.reorder(opt_path)
 
     def classical_find_convex_hull(self):
@@ -48,30 +93,37 @@ class SingleCluster(BaseCluster):
             self.convex_hull = self.elements
         else:
             try:
-                hull = ConvexHull(self.elements)
-                hull_vertices = hull.vertices
-                for vertex in hull_vertices:
-                    self.convex_hull.append(self.elements[vertex])
+                hull = ConvexHull(self.get_coords())
+                self.convex_hull = self.elements[hull.vertices]
             except QhullError:
                 # 说明这个点集都沿着同一条直线排列
-                max_dist = -1
-                for i in range(self.element_num):
-                    tmp_dist = util.cal_similarity(self.elements[i - 1], self.elements[i])
-                    if tmp_dist > max_dist:
-                        max_dist = tmp_dist
-                        self.convex_hull = [self.elements[i - 1], self.elements[i]]
+                dists = self.dist_matrix.pair_dists(np.roll(self.elements, 1), self.elements)
+                i = int(dists.argmax())
+                self.convex_hull = self.elements[[i - 1, i]]
 
-    def find_convex_hull(self):
+    def quantum_find_convex_hull(self):
         if len(self.elements) < 3:
             self.convex_hull = self.elements
         else:
-            self.convex_hull = QCH(self.elements, self.env, self.backend, self.print_detail).find_convex_hull()
+            hull_indices = QCH(self.get_coords().tolist(), self.env, self.backend, self.print_detail,
+                               self.inner_product_mode, self.max_qubit_num).find_convex_hull()
+            self.convex_hull = self.elements[hull_indices]
+
+    def find_convex_hull(self):
+        if self.hull_engine == 'qchsa':
+            self.quantum_find_convex_hull()
+        elif self.hull_engine == 'qhull':
+            self.classical_find_convex_hull()
+        else:
+            self.convex_hull = self.elements[monotone_chain(self.get_coords())]
 
     def get_convex_hull(self):
+        if self.convex_hull is None:
+            self.find_convex_hull()
         if self.element_num > 1:
-            return [point for point in self.convex_hull if point != self.head and point != self.tail]
+            return self.convex_hull[(self.convex_hull != self.head) & (self.convex_hull != self.tail)]
         else:
             return self.convex_hull
 
     def get_point_num(self):
-        return self.element_num
\ No newline at end of file
+        return self.element_num
@@ -0,0 +1,74 @@
+# -*- coding: UTF-8 -*-
+import numpy as np
+from scipy.spatial.distance import cdist
+
+# the largest number of cities whose full distance matrix is stored, the distances of larger instances
+# are calculated from coordinates on demand
+DENSE_MAX_POINT_NUM = 5000
+
+
+class DistanceMatrix:
+    def __init__(self, points):
+        """
+        the pairwise distances of all cities, which is built once and shared by all clusters
+        :param points: list or numpy array with the shape of (n, 2), coordinates of all cities
+        """
+        self.coords = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+        self.point_num = len(self.coords)
+        self.matrix = cdist(self.coords, self.coords) if self.point_num <= DENSE_MAX_POINT_NUM else None
+
+    def dist(self, i: int, j: int) -> float:
+        """
+        the distance between the i-th and the j-th point
+        """
+        if self.matrix is None:
+            return float(np.hypot(*(self.coords[i] - self.coords[j])))
+        return float(self.matrix[i, j])
+
+    def pair_dists(self, ids_1, ids_2) -> np.ndarray:
+        """
+        the distances between the points of ids_1 and ids_2 pairwise
+        :param ids_1: list or numpy array, point IDs
+        :param ids_2: list or numpy array, point IDs with the same length as ids_1
+        """
+        ids_1 = np.asarray(ids_1, dtype=np.int64)
+        ids_2 = np.asarray(ids_2, dtype=np.int64)
+        if self.matrix is None:
+            return np.hypot(*(self.coords[ids_1] - self.coords[ids_2]).T)
+        return self.matrix[ids_1, ids_2]
+
+    def sub_matrix(self, ids) -> np.ndarray:
+        """
+        the distance matrix among the given points
+        :param ids: list or numpy array, point IDs
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.matrix is None:
+            return cdist(self.coords[ids], self.coords[ids])
+        return self.matrix[np.ix_(ids, ids)]
+
+    def cross_matrix(self, ids_1, ids_2) -> np.ndarray:
+        """
+        the distance matrix between two groups of points
+        :param ids_1: list or numpy array, point IDs of the first group
+        :param ids_2: list or numpy array, point IDs of the second group
+        """
+        ids_1 = np.asarray(ids_1, dtype=np.int64)
+        ids_2 = np.asarray(ids_2, dtype=np.int64)
+        if self.matrix is None:
+            return cdist(self.coords[ids_1], self.coords[ids_2])
+        return self.matrix[np.ix_(ids_1, ids_2)]
+
+    def path_len(self, ids, is_cycle: bool = True) -> float:
+        """
+        the total length of a route
+        :param ids: list or numpy array, point IDs in the order of route
+        :param is_cycle: boolean, whether the route goes back to the first point
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) < 2:
+            return 0.
+        length = self.pair_dists(ids[:-1], ids[1:]).sum()
+        if is_cycle:
+            length += self.dist(ids[-1], ids[0])
+        return float(length)
@@ -1,41 +1,214 @@
 # -*- coding: UTF-8 -*-
-from qiskit import transpile
+from collections import OrderedDict
+
+from qiskit import transpile, QuantumCircuit
+from qiskit.circuit import ParameterExpression, ParameterVector
+from qiskit.circuit.library import get_standard_gate_name_mapping
 from qiskit_ibm_runtime import QiskitRuntimeService, Options, Sampler, Session
 from qiskit_aer import AerSimulator
 from qiskit.providers.fake_provider import Fake27QPulseV1, Fake127QPulseV1, GenericBackendV2
 
+STANDARD_GATES = set(get_standard_gate_name_mapping().keys())
+# the rotation gates whose angles are lifted to parameters when looking up the transpiled circuit,
+# so that circuits only differing in these angles share one transpilation
+ANGLE_GATES = {'u', 'u1', 'u2', 'u3', 'p', 'r', 'rx', 'ry', 'rz', 'cp', 'cu1', 'crx', 'cry', 'crz', 'rxx', 'ryy',
+               'rzz', 'rzx'}
+TRANSPILE_CACHE_SIZE = 128
+
+
+def bind_parameters(trans_qc: QuantumCircuit, params, values) -> QuantumCircuit:
+    """
+    binding the values to the parameters of a transpiled circuit
+    :param trans_qc: the transpiled circuit, from which the transpiler may drop the gates whose angles have no effect
+    :param params: the parameters of the circuit before transpilation
+    :param values: the values in the same order as params
+    """
+    remaining = set(trans_qc.parameters)
+    return trans_qc.assign_parameters({param: value for param, value in zip(params, values) if param in remaining})
+
+
+class TranspileCache:
+    def __init__(self, max_size=TRANSPILE_CACHE_SIZE):
+        """
+        the LRU cache of transpiled circuits, keyed by the structure of circuit and the target backend
+        :param max_size: int, the maximum number of transpiled circuits kept in cache
+        """
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def structure_key(self, qc: QuantumCircuit, lift_angles: bool) -> tuple:
+        """
+        building the hashable structure of circuit and collecting the angles of ANGLE_GATES
+        :param qc: QuantumCircuit
+        :param lift_angles: boolean, whether the angles of ANGLE_GATES are excluded from the key
+        :return: the key and the list of lifted angles
+        """
+        qubit_index = {qubit: i for i, qubit in enumerate(qc.qubits)}
+        clbit_index = {clbit: i for i, clbit in enumerate(qc.clbits)}
+        key = [tuple(len(reg) for reg in qc.qregs), tuple(len(reg) for reg in qc.cregs), float(qc.global_phase)]
+        angles = []
+        for instruction in qc.data:
+            op = instruction.operation
+            qubits = tuple(qubit_index[qubit] for qubit in instruction.qubits)
+            clbits = tuple(clbit_index[clbit] for clbit in instruction.clbits)
+            if lift_angles and op.name in ANGLE_GATES and not any(
+                    isinstance(param, ParameterExpression) for param in op.params):
+                angles += [float(param) for param in op.params]
+                key.append((op.name, qubits, clbits))
+                continue
+
+            params = tuple(str(param) if isinstance(param, ParameterExpression) else repr(param)
+                           for param in op.params)
+            # custom instructions are distinguished by their definitions, whose angles are kept in the key
+            definition = None
+            if op.name not in STANDARD_GATES and getattr(op, 'definition', None) is not None:
+                definition = self.structure_key(op.definition, False)[0]
+            key.append((op.name, qubits, clbits, params, definition))
+        return tuple(key), angles
+
+    @staticmethod
+    def build_template(qc: QuantumCircuit, angle_num: int) -> tuple[QuantumCircuit, list]:
+        """
+        replacing the angles of ANGLE_GATES with parameters
+        :param qc: QuantumCircuit
+        :param angle_num: int, the number of lifted angles
+        :return: the parameterized circuit and its parameters in order
+        """
+        if angle_num == 0:
+            return qc, []
+        params = ParameterVector('angle', angle_num)
+        template = qc.copy_empty_like()
+        index = 0
+        for instruction in qc.data:
+            op = instruction.operation
+            if op.name in ANGLE_GATES and not any(isinstance(param, ParameterExpression) for param in op.params):
+                op = type(op)(*params[index: index + len(op.params)])
+                index += len(op.params)
+            template.append(op, instruction.qubits, instruction.clbits)
+        return template, list(params)
+
+    def get(self, qc: QuantumCircuit, backend, backend_key) -> QuantumCircuit:
+        """
+        getting the transpiled circuit, transpiling only when no circuit with the same structure is cached
+        :param qc: QuantumCircuit
+        :param backend: the target backend of transpilation
+        :param backend_key: hashable, the identity of backend
+        """
+        structure, angles = self.structure_key(qc, True)
+        key = (structure, backend_key)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            trans_template, params = self.cache[key]
+        else:
+            self.misses += 1
+            template, params = self.build_template(qc, len(angles))
+            trans_template = transpile(template, backend)
+            self.cache[key] = (trans_template, params)
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+        if not params:
+            return trans_template
+        return bind_parameters(trans_template, params, angles)
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+transpile_cache = TranspileCache()
+_simulators = dict()
+_device_backends = dict()
+
+
+def get_backend(num_qubits, env, noisy, backend):
+    """
+    getting the backend which the circuit runs on, the backends are built once and reused
+    :param num_qubits: int, the number of qubits in circuit
+    :param env: string, the environment type for implementing the circuit
+    :param noisy: boolean, whether to add noise to circuit on simulators
+    :param backend: string, the backend name when running the circuit on real quantum devices
+    :return: the backend and its hashable identity
+    """
+    if env == 'sim':
+        backend_key = ('sim', num_qubits) if noisy else ('sim', None)
+        if backend_key not in _simulators:
+            if noisy:
+                device_backend = GenericBackendV2(num_qubits)
+                _simulators[backend_key] = AerSimulator.from_backend(device_backend)
+            else:
+                _simulators[backend_key] = AerSimulator()
+                # device_backend = GenericBackendV2(qc.num_qubits)
+                # simulator = AerSimulator.from_backend(device_backend)
+        return _simulators[backend_key], backend_key
+    else:
+        if backend not in _device_backends:
+            service = QiskitRuntimeService()
+            _device_backends[backend] = service.backend(backend)
+        return _device_backends[backend], ('real', backend)
+
+
+def transpile_qcircuit(qc, env, noisy, backend):
+    """
+    transpiling the circuit for the target backend through the transpile cache
+    """
+    device_backend, backend_key = get_backend(qc.num_qubits, env, noisy, backend)
+    return transpile_cache.get(qc, device_backend, backend_key)
+
+
+def clear_transpile_cache():
+    transpile_cache.clear()
+
 
 def exec_qcircuit(qc, shots, env, noisy, backend, print_detail=True):
     if print_detail:
         print("The circuit depth before transpile", qc.depth())
 
+    device_backend, _ = get_backend(qc.num_qubits, env, noisy, backend)
+    trans_qc = transpile_qcircuit(qc, env, noisy, backend)
+    if print_detail:
+        print("The circuit depth after transpile", trans_qc.depth())
     if env == 'sim':
-        if noisy:
-            device_backend = GenericBackendV2(qc.num_qubits)
-            simulator = AerSimulator.from_backend(device_backend)
-        else:
-            simulator = AerSimulator()
-            # device_backend = GenericBackendV2(qc.num_qubits)
-            # simulator = AerSimulator.from_backend(device_backend)
-        trans_qc = transpile(qc, simulator)
-        if print_detail:
-            print("The circuit depth after transpile", trans_qc.depth())
-        job = simulator.run(trans_qc, shots=shots)
+        job = device_backend.run(trans_qc, shots=shots)
     else:
         # real quantum computer
-        service = QiskitRuntimeService()
-        device_backend = service.backend(backend)
         sampler = Sampler(backend=device_backend)
-        trans_qc = transpile(qc, device_backend)
-        if print_detail:
-            print("The circuit depth after transpile", trans_qc.depth())
         job = sampler.run(circuits=trans_qc, shots=shots)
     return job
 
 
+def run_qcircuits(trans_qcs, shots, env, noisy, backend):
+    """
+    submitting a list of transpiled circuits as one job
+    :param trans_qcs: list, the transpiled circuits with the same number of qubits
+    """
+    device_backend, _ = get_backend(trans_qcs[0].num_qubits, env, noisy, backend)
+    if env == 'sim':
+        job = device_backend.run(trans_qcs, shots=shots)
+    else:
+        sampler = Sampler(backend=device_backend)
+        job = sampler.run(circuits=trans_qcs, shots=shots)
+    return job
+
+
 def get_output(job, env):
     if env == 'sim':
         output = job.result().get_counts()
     else:
         output = job.result().quasi_dists[0]
     return output
+
+
+def get_outputs(job, env):
+    """
+    getting the outputs of all circuits in a job submitted by run_qcircuits
+    """
+    result = job.result()
+    if env == 'sim':
+        return [result.get_counts(i) for i in range(len(result.results))]
+    else:
+        return list(result.quasi_dists)
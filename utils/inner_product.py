@@ -1,7 +1,81 @@
+from collections import OrderedDict
+
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+from qiskit.circuit import ParameterVector
 from utils import execute, util
+from utils.job_pipeline import JobPipeline, MAX_IN_FLIGHT
 
 import math as m
+import numpy as np
+
+SHOTS = 20000
+# the number of swap-test circuits submitted in one job by cal_inner_products
+CIRCUITS_PER_JOB = 16
+# circuit: running swap tests on the backend; analytic: the exact expectation of swap tests;
+# sampled: the exact probability with binomial shot noise
+INNER_PRODUCT_MODES = ('circuit', 'analytic', 'sampled')
+# the parameterized swap-test circuits, keyed by task_num_per_circuit
+_templates = dict()
+SIMILARITY_CACHE_SIZE = 100000
+# the normalized vectors are rounded to this precision in the keys of SimilarityCache
+SIMILARITY_PRECISION = 1e-6
+
+
+class AnalyticJob:
+    def __init__(self, values):
+        """
+        the swap-test results computed in closed form, which take the place of a job
+        :param values: list, the number of outcome 0 of each swap test
+        """
+        self.values = values
+
+    def done(self) -> bool:
+        return True
+
+
+class SimilarityCache:
+    def __init__(self, max_size=SIMILARITY_CACHE_SIZE, precision=SIMILARITY_PRECISION):
+        """
+        the LRU cache of swap-test results, keyed by the pair of quantized vectors and the way they are evaluated
+        :param max_size: int, the maximum number of results kept in cache
+        :param precision: float, the vectors closer than precision share the results
+        """
+        self.max_size = max_size
+        self.precision = precision
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, vec_1, vec_2, env, backend, mode) -> tuple:
+        point_1 = (round(vec_1[0] / self.precision), round(vec_1[1] / self.precision))
+        point_2 = (round(vec_2[0] / self.precision), round(vec_2[1] / self.precision))
+        # the swap test is symmetric
+        return (env, backend, mode) + tuple(sorted((point_1, point_2)))
+
+    def get(self, key):
+        """
+        :return: the cached result, or None if the key is not in cache
+        """
+        if key not in self.cache:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def put(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+similarity_cache = SimilarityCache()
 
 
 # def normalization(self, point) -> list:
@@ -29,26 +103,112 @@ def to_bloch_state(vec):
     return theta, phi
 
 
-def cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, env, backend, print_detail=False):
-    q = QuantumRegister(task_num_per_circuit * 3)
-    cl = ClassicalRegister(task_num_per_circuit)
-    qc = QuantumCircuit(q, cl)
+def to_bloch_states(vec_list) -> np.ndarray:
+    """
+    the vectorized version of to_bloch_state
+    :param vec_list: list or numpy array with the shape of (n, 2)
+    :return: numpy array with the shape of (n, 2), whose columns are theta and phi
+    """
+    vecs = np.asarray(vec_list, dtype=np.float64).reshape(-1, 2)
+    return np.stack((m.pi / 2 * (vecs[:, 0] + vecs[:, 1]), m.pi / 2 * (vecs[:, 0] - vecs[:, 1] + 1)), axis=1)
+
+
+def cal_swap_test_prob(vec_list_1, vec_list_2) -> np.ndarray:
+    """
+    the probability that the ancilla of swap test is 0, which is (1 + |<a|b>|^2) / 2 for the Bloch states a and b
+    :param vec_list_1: list, the first vector of each pair
+    :param vec_list_2: list, the second vector of each pair
+    """
+    states_1 = to_bloch_states(vec_list_1)
+    states_2 = to_bloch_states(vec_list_2)
+    # u(theta, phi, 0)|0> = cos(theta / 2)|0> + e^(i * phi) * sin(theta / 2)|1>
+    overlap = (np.cos(states_1[:, 0] / 2) * np.cos(states_2[:, 0] / 2) +
+               np.exp(1j * (states_2[:, 1] - states_1[:, 1])) * np.sin(states_1[:, 0] / 2) * np.sin(states_2[:, 0] / 2))
+    return np.clip((1 + np.abs(overlap) ** 2) / 2, 0, 1)
+
+
+def to_swap_test_probs(values, env, mode='circuit', shots=SHOTS) -> np.ndarray:
+    """
+    converting the results of swap tests to the probabilities of outcome 0
+    :param values: list, the results of get_inner_product_result or cal_inner_products
+    """
+    values = np.asarray(values, dtype=np.float64)
+    # the results on real devices are summed from quasi-probabilities
+    return values / shots if env == 'sim' or mode != 'circuit' else values
+
+
+def to_state_dists(probs) -> np.ndarray:
+    """
+    the trace distance sqrt(1 - |<a|b>|^2) between the states of swap tests, which is a metric
+    :param probs: numpy array, the probabilities of outcome 0
+    """
+    return np.sqrt(np.clip(2 * (1 - np.asarray(probs, dtype=np.float64)), 0, None))
+
 
+def cal_analytic_values(vec_list_1, vec_list_2, task_num, mode, shots=SHOTS, rng=None) -> list:
+    """
+    emulating the number of outcome 0 of swap tests without running circuits
+    :param task_num: int, the length of result, the unused tasks are always 0 as in circuits
+    :param mode: string, analytic or sampled
+    :param rng: int or numpy Generator, the source of shot noise in the sampled mode, unseeded by default
+    """
+    values = np.full(task_num, float(shots))
     vec_num = len(vec_list_1)
-    bloch_state_1 = [to_bloch_state(vec) for vec in vec_list_1]
-    bloch_state_2 = [to_bloch_state(vec) for vec in vec_list_2]
-    task_idx = 0
-    for i in range(vec_num):
-        qc.u(bloch_state_1[i][0], bloch_state_1[i][1], 0, q[task_idx * 3 + 1])
-        qc.u(bloch_state_2[i][0], bloch_state_2[i][1], 0, q[task_idx * 3 + 2])
+    if vec_num > 0:
+        prob = cal_swap_test_prob(vec_list_1, vec_list_2[:vec_num])
+        values[:vec_num] = np.random.default_rng(rng).binomial(shots, prob) if mode == 'sampled' else shots * prob
+    return values.tolist()
 
-        qc.h(q[task_idx * 3])
-        qc.cswap(q[task_idx * 3], q[task_idx * 3 + 1], q[task_idx * 3 + 2])
-        qc.h(q[task_idx * 3])
 
-        qc.measure(q[task_idx * 3], cl[task_idx])
+def swap_test_template(task_num_per_circuit) -> tuple[QuantumCircuit, ParameterVector]:
+    """
+    the swap-test circuit whose Bloch angles are parameters, the angles of the i-th task are
+    params[4 * i: 4 * i + 4] = (theta_1, phi_1, theta_2, phi_2)
+    :param task_num_per_circuit: int, the number of swap tests in circuit
+    """
+    if task_num_per_circuit not in _templates:
+        params = ParameterVector('bloch', task_num_per_circuit * 4)
+        q = QuantumRegister(task_num_per_circuit * 3)
+        cl = ClassicalRegister(task_num_per_circuit)
+        qc = QuantumCircuit(q, cl)
+        for i in range(task_num_per_circuit):
+            qc.u(params[i * 4], params[i * 4 + 1], 0, q[i * 3 + 1])
+            qc.u(params[i * 4 + 2], params[i * 4 + 3], 0, q[i * 3 + 2])
+
+            qc.h(q[i * 3])
+            qc.cswap(q[i * 3], q[i * 3 + 1], q[i * 3 + 2])
+            qc.h(q[i * 3])
 
-        task_idx += 1
+            qc.measure(q[i * 3], cl[i])
+        _templates[task_num_per_circuit] = (qc, params)
+    return _templates[task_num_per_circuit]
+
+
+def bind_swap_test(trans_template, params, vec_list_1, vec_list_2, task_num_per_circuit) -> QuantumCircuit:
+    """
+    binding the Bloch angles of vector pairs to the transpiled template, the unused tasks stay in |0>
+    """
+    angles = np.zeros((task_num_per_circuit, 4))
+    vec_num = len(vec_list_1)
+    if vec_num > 0:
+        angles[:vec_num, :2] = to_bloch_states(vec_list_1)
+        angles[:vec_num, 2:] = to_bloch_states(vec_list_2[:vec_num])
+    return execute.bind_parameters(trans_template, params, angles.flatten())
+
+
+def cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, env, backend, print_detail=False, shots=SHOTS,
+                      mode='circuit', rng=None):
+    """
+    estimating the inner products of vector pairs by swap tests in one circuit, which is bound from the template
+    :param vec_list_1: list, the first vector of each pair
+    :param vec_list_2: list, the second vector of each pair
+    :param task_num_per_circuit: int, the number of swap tests in circuit
+    :param mode: string, one of INNER_PRODUCT_MODES
+    :param rng: int or numpy Generator, the source of shot noise in the sampled mode
+    :return: the job, whose result is parsed by get_inner_product_result
+    """
+    if mode != 'circuit':
+        return AnalyticJob(cal_analytic_values(vec_list_1, vec_list_2, task_num_per_circuit, mode, shots, rng))
 
     # base_theta, base_phi = to_bloch_state(vec_list_1)
     # for i in range(num_2):
@@ -63,7 +223,12 @@ def cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, env, backend
     # for i in range(num_2):
     #     qc.measure(q[i * 3], cl[i])
 
-    job = execute.exec_qcircuit(qc, 20000, env, False, backend, print_detail)
+    qc, params = swap_test_template(task_num_per_circuit)
+    trans_qc = bind_swap_test(execute.transpile_qcircuit(qc, env, False, backend), params, vec_list_1, vec_list_2,
+                              task_num_per_circuit)
+    if print_detail:
+        print("The circuit depth after transpile", trans_qc.depth())
+    job = execute.run_qcircuits([trans_qc], shots, env, False, backend)
     return job
     # output = execute.get_output(job, env)
     #
@@ -74,9 +239,37 @@ def cal_inner_product(vec_list_1, vec_list_2, task_num_per_circuit, env, backend
     # return output_dict
 
 
-def get_inner_product_result(job, task_num_per_circuit, env):
-    output = execute.get_output(job, env)
+def cal_inner_product_batch(vec_list_1, vec_list_2, task_num_per_circuit, env, backend, print_detail=False,
+                            shots=SHOTS, mode='circuit', rng=None):
+    """
+    splitting the vector pairs into circuits of task_num_per_circuit swap tests and submitting all of them as one job
+    :param vec_list_1: list, the first vector of each pair
+    :param vec_list_2: list, the second vector of each pair
+    :param task_num_per_circuit: int, the number of swap tests in each circuit
+    :param mode: string, one of INNER_PRODUCT_MODES
+    :param rng: int or numpy Generator, the source of shot noise in the sampled mode
+    :return: the job, whose result is parsed by get_inner_product_batch_result
+    """
+    if mode != 'circuit':
+        # padding to whole circuits as the circuit mode does
+        task_num = -(-len(vec_list_1) // task_num_per_circuit) * task_num_per_circuit
+        return AnalyticJob(cal_analytic_values(vec_list_1, vec_list_2, task_num, mode, shots, rng))
+
+    qc, params = swap_test_template(task_num_per_circuit)
+    trans_template = execute.transpile_qcircuit(qc, env, False, backend)
+    trans_qcs = []
+    for i in range(0, len(vec_list_1), task_num_per_circuit):
+        trans_qcs.append(bind_swap_test(trans_template, params, vec_list_1[i: i + task_num_per_circuit],
+                                        vec_list_2[i: i + task_num_per_circuit], task_num_per_circuit))
+    if print_detail:
+        print(f"Submitting {len(trans_qcs)} swap-test circuits in one job")
+    return execute.run_qcircuits(trans_qcs, shots, env, False, backend)
 
+
+def count_zero_outcomes(output, task_num_per_circuit, env) -> list:
+    """
+    counting the outcome 0 of the ancilla of each swap test
+    """
     values = [0 for _ in range(task_num_per_circuit)]
     for item in output.items():
         tmp_key = item[0]
@@ -88,6 +281,13 @@ def get_inner_product_result(job, task_num_per_circuit, env):
 
     return values
 
+
+def get_inner_product_result(job, task_num_per_circuit, env):
+    if isinstance(job, AnalyticJob):
+        return job.values
+    output = execute.get_output(job, env)
+    return count_zero_outcomes(output, task_num_per_circuit, env)
+
     # res = list()
     # for i in range(num_1):
     #     res.append(values[i * num_2: (i + 1) * num_2].index(max(values[i * num_2: (i + 1) * num_2])))
@@ -101,6 +301,77 @@ def get_inner_product_result(job, task_num_per_circuit, env):
     # return res.index(max(res))
 
 
+def cal_inner_products(vec_list_1, vec_list_2, task_num_per_circuit, env, backend, print_detail=False,
+                       mode='circuit', max_in_flight=MAX_IN_FLIGHT, circuits_per_job=CIRCUITS_PER_JOB,
+                       rng=None) -> list:
+    """
+    estimating the inner products of any number of vector pairs, the pairs are split into circuits of
+    task_num_per_circuit swap tests, every circuits_per_job circuits are submitted as one job by
+    cal_inner_product_batch and up to max_in_flight of the jobs run at the same time
+    :param mode: string, one of INNER_PRODUCT_MODES
+    :param max_in_flight: int, the maximum number of unfinished jobs
+    :param circuits_per_job: int, the number of circuits in each job
+    :param rng: int or numpy Generator, the source of shot noise in the sampled mode, which makes the results
+                reproducible when it is seeded
+    :return: the number of outcome 0 of each pair, in the order of vector pairs
+    """
+    # a seed is turned into one generator, otherwise every job would draw the same noise
+    rng = np.random.default_rng(rng)
+    pipeline = JobPipeline(lambda job: get_inner_product_batch_result(job, task_num_per_circuit, env), max_in_flight)
+    # only the last job may have a partial circuit, so the results of jobs can be concatenated
+    task_num_per_job = task_num_per_circuit * max(1, circuits_per_job)
+    for start in range(0, len(vec_list_1), task_num_per_job):
+        pipeline.submit(cal_inner_product_batch, vec_list_1[start: start + task_num_per_job],
+                        vec_list_2[start: start + task_num_per_job], task_num_per_circuit, env, backend,
+                        print_detail, mode=mode, rng=rng)
+
+    values = []
+    for values_per_job in pipeline.drain():
+        values += values_per_job
+    # dropping the unused tasks of the last circuit
+    return values[:len(vec_list_1)]
+
+
+def cal_memoized_inner_products(vec_list_1, vec_list_2, task_num_per_circuit, env, backend, print_detail=False,
+                                mode='circuit', max_in_flight=MAX_IN_FLIGHT, cache=None, rng=None) -> list:
+    """
+    cal_inner_products whose results are memoized, only the distinct pairs that are not in cache are evaluated
+    :param cache: SimilarityCache, the shared similarity_cache by default
+    :param rng: int or numpy Generator, the source of shot noise in the sampled mode
+    """
+    cache = similarity_cache if cache is None else cache
+    keys = [cache.get_key(vec_1, vec_2, env, backend, mode) for vec_1, vec_2 in zip(vec_list_1, vec_list_2)]
+    values = [cache.get(key) for key in keys]
+
+    # the key -> the index of its first missing pair
+    missing = dict()
+    for index, (key, value) in enumerate(zip(keys, values)):
+        if value is None and key not in missing:
+            missing[key] = index
+    if missing:
+        outputs = cal_inner_products([vec_list_1[i] for i in missing.values()],
+                                     [vec_list_2[i] for i in missing.values()], task_num_per_circuit, env, backend,
+                                     print_detail, mode, max_in_flight, rng=rng)
+        # the results are kept locally as well, since the cache may evict them when it is small
+        computed = dict(zip(missing, outputs))
+        for key, output in computed.items():
+            cache.put(key, output)
+        values = [computed[key] if value is None else value for key, value in zip(keys, values)]
+    return values
+
+
+def get_inner_product_batch_result(job, task_num_per_circuit, env) -> list:
+    """
+    the results of all swap tests in a job submitted by cal_inner_product_batch, in the order of vector pairs
+    """
+    if isinstance(job, AnalyticJob):
+        return job.values
+    values = []
+    for output in execute.get_outputs(job, env):
+        values += count_zero_outcomes(output, task_num_per_circuit, env)
+    return values
+
+
 if __name__ == '__main__':
     base_vec = [3, 5]
     cur_vec_list = [[1, 6], [4, 3]]
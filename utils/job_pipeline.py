@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+import time
+
+# the default number of unfinished jobs, which is within the concurrency limit of runtime sessions
+MAX_IN_FLIGHT = 3
+POLL_INTERVAL = 0.01
+
+
+def is_finished(job) -> bool:
+    """
+    whether the job is in a final state, i.e. done, failed or cancelled
+    """
+    if hasattr(job, 'in_final_state'):
+        return job.in_final_state()
+    return job.done()
+
+
+class JobPipeline:
+    def __init__(self, collect, max_in_flight=MAX_IN_FLIGHT, poll_interval=POLL_INTERVAL):
+        """
+        submitting jobs without blocking on earlier ones, the results are collected as soon as jobs finish
+        and are returned in the order of submission
+        :param collect: function, parsing the result of a finished job,
+                        e.g. inner_product.get_inner_product_batch_result
+        :param max_in_flight: int, the maximum number of unfinished jobs
+        :param poll_interval: float, the seconds to wait before checking the unfinished jobs again
+        """
+        self.collect = collect
+        self.max_in_flight = max(1, max_in_flight)
+        self.poll_interval = poll_interval
+        # the index of submission -> the unfinished job
+        self.pending = dict()
+        self.results = dict()
+        self.job_num = 0
+
+    def collect_finished(self) -> int:
+        """
+        collecting the results of all finished jobs
+        :return: the number of collected jobs
+        """
+        # a failed job is never done, its error is raised when the result is collected
+        finished = [index for index, job in self.pending.items() if is_finished(job)]
+        for index in finished:
+            self.results[index] = self.collect(self.pending.pop(index))
+        return len(finished)
+
+    def wait(self, max_pending):
+        """
+        waiting until the number of unfinished jobs is not more than max_pending
+        """
+        while len(self.pending) > max_pending:
+            if self.collect_finished() == 0:
+                time.sleep(self.poll_interval)
+
+    def submit(self, submit_job, *args, **kwargs) -> int:
+        """
+        submitting a job once there is a free slot
+        :param submit_job: function, submitting the job and returning it, e.g. inner_product.cal_inner_product_batch
+        :return: the index of job, which is the position of its result in drain()
+        """
+        self.wait(self.max_in_flight - 1)
+        index = self.job_num
+        self.pending[index] = submit_job(*args, **kwargs)
+        self.job_num += 1
+        return index
+
+    def drain(self) -> list:
+        """
+        waiting for all jobs and returning their results in the order of submission
+        """
+        self.wait(0)
+        results = [self.results[index] for index in range(self.job_num)]
+        self.results.clear()
+        self.job_num = 0
+        return results
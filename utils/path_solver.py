@@ -0,0 +1,198 @@
+# -*- coding: UTF-8 -*-
+import numpy as np
+
+# the largest number of points (including the start and the end) that Held-Karp accepts,
+# the memory cost of the table is 2 ** (n - 2) * (n - 2) floats
+HELD_KARP_MAX_SIZE = 20
+# the worst case of branch and bound is factorial, larger subproblems are rejected rather than left running
+BRANCH_AND_BOUND_MAX_SIZE = 25
+
+
+def cal_path_len(dist_adj: np.ndarray, path: list) -> float:
+    """
+    calculating the length of a path based on the distance matrix
+    :param dist_adj: numpy array, the distance matrix
+    :param path: list, the order of points
+    """
+    return float(sum(dist_adj[path[i - 1]][path[i]] for i in range(1, len(path))))
+
+
+def held_karp(dist_adj: np.ndarray) -> tuple[list, float]:
+    """
+    finding the shortest Hamiltonian path whose start is the first point and whose end is the last point,
+    the dynamic programming table is indexed by (bitmask of visited inner points, last visited inner point)
+    :param dist_adj: numpy array, the distance matrix of all points in the path
+    :return: the optimal path (the same contract as util.find_optimal_path) and its length
+    """
+    dist_adj = np.asarray(dist_adj, dtype=np.float64)
+    point_num = len(dist_adj)
+    if point_num <= 3:
+        path = [i for i in range(point_num)]
+        return path, cal_path_len(dist_adj, path)
+    if point_num > HELD_KARP_MAX_SIZE:
+        raise ValueError(f"Held-Karp supports at most {HELD_KARP_MAX_SIZE} points, but got {point_num}")
+
+    # only the points between the start and the end are permuted
+    inner_num = point_num - 2
+    inner_adj = dist_adj[1:-1, 1:-1]
+    full_mask = (1 << inner_num) - 1
+    bits = 1 << np.arange(inner_num)
+    masks = np.arange(full_mask + 1)
+    popcount = ((masks[:, np.newaxis] & bits) != 0).sum(axis=1)
+
+    dp = np.full((full_mask + 1, inner_num), np.inf)
+    parent = np.full((full_mask + 1, inner_num), -1, dtype=np.int8)
+    dp[bits, np.arange(inner_num)] = dist_adj[0, 1:-1]
+
+    for size in range(2, inner_num + 1):
+        layer = masks[popcount == size]
+        for j in range(inner_num):
+            cur_masks = layer[(layer & bits[j]) != 0]
+            # dp[prev_masks, j] is infinite, so j can never be its own predecessor
+            candidates = dp[cur_masks ^ bits[j]] + inner_adj[:, j]
+            best = candidates.argmin(axis=1)
+            dp[cur_masks, j] = candidates[np.arange(len(cur_masks)), best]
+            parent[cur_masks, j] = best
+
+    final_lens = dp[full_mask] + dist_adj[1:-1, -1]
+    last = int(final_lens.argmin())
+    min_len = float(final_lens[last])
+
+    # backtracking from the end
+    inner_order = []
+    mask = full_mask
+    while last >= 0:
+        inner_order.append(last)
+        prev = int(parent[mask, last])
+        mask ^= int(bits[last])
+        last = prev
+
+    opt_path = [0] + [i + 1 for i in reversed(inner_order)] + [point_num - 1]
+    return opt_path, min_len
+
+
+def cal_mst_len(dist_adj: np.ndarray, nodes: list) -> float:
+    """
+    calculating the length of the minimum spanning tree over the given nodes with Prim's algorithm
+    :param dist_adj: numpy array, the distance matrix of all points
+    :param nodes: list, the indices of nodes in the tree
+    """
+    if len(nodes) <= 1:
+        return 0.
+    sub_adj = dist_adj[np.ix_(nodes, nodes)]
+    in_tree = np.zeros(len(nodes), dtype=bool)
+    in_tree[0] = True
+    min_edge = sub_adj[0].copy()
+    mst_len = 0.
+    for _ in range(len(nodes) - 1):
+        min_edge[in_tree] = np.inf
+        k = int(min_edge.argmin())
+        mst_len += min_edge[k]
+        in_tree[k] = True
+        min_edge = np.minimum(min_edge, sub_adj[k])
+    return float(mst_len)
+
+
+def nearest_neighbor_path(dist_adj: np.ndarray) -> tuple[list, float]:
+    """
+    building a greedy path from the first point to the last point, which is the initial incumbent of branch and bound
+    :param dist_adj: numpy array, the distance matrix of all points in the path
+    """
+    point_num = len(dist_adj)
+    path = [0]
+    remaining = set(range(1, point_num - 1))
+    while remaining:
+        cur = path[-1]
+        nxt = min(remaining, key=lambda i: dist_adj[cur][i])
+        path.append(nxt)
+        remaining.remove(nxt)
+    if point_num > 1:
+        path.append(point_num - 1)
+    return path, cal_path_len(dist_adj, path)
+
+
+def branch_and_bound(dist_adj: np.ndarray) -> tuple[list, float]:
+    """
+    finding the shortest Hamiltonian path whose start is the first point and whose end is the last point,
+    a branch is cut when its length plus the MST of the unvisited points (a lower bound of the remaining path)
+    is not shorter than the incumbent; children are visited from the nearest to the farthest
+    :param dist_adj: numpy array, the distance matrix of all points in the path
+    :return: the optimal path (the same contract as util.find_optimal_path) and its length
+    """
+    dist_adj = np.asarray(dist_adj, dtype=np.float64)
+    point_num = len(dist_adj)
+    if point_num <= 3:
+        path = [i for i in range(point_num)]
+        return path, cal_path_len(dist_adj, path)
+
+    opt_path, min_len = nearest_neighbor_path(dist_adj)
+    end = point_num - 1
+    # the candidates of each point sorted by distance, excluding the start and the end
+    neighbor_order = [[int(j) for j in np.argsort(dist_adj[i]) if 0 < j < end] for i in range(point_num)]
+
+    cur_path = [0]
+    is_chosen = [False for _ in range(point_num)]
+
+    def search(cur_len):
+        nonlocal opt_path, min_len
+        cur = cur_path[-1]
+        if len(cur_path) == point_num - 1:
+            total_len = cur_len + dist_adj[cur][end]
+            if total_len < min_len:
+                min_len = total_len
+                opt_path = cur_path + [end]
+            return
+
+        # the remaining path connects cur, all unvisited points and the end, so it is no shorter than their MST
+        unvisited = [i for i in range(1, end) if not is_chosen[i]]
+        if cur_len + cal_mst_len(dist_adj, [cur, *unvisited, end]) >= min_len:
+            return
+
+        for i in neighbor_order[cur]:
+            if is_chosen[i]:
+                continue
+            next_len = cur_len + dist_adj[cur][i]
+            if next_len >= min_len:
+                # the candidates are sorted, so the rest are not shorter
+                break
+            cur_path.append(i)
+            is_chosen[i] = True
+            search(next_len)
+            is_chosen[i] = False
+            cur_path.pop()
+
+    search(0.)
+    return opt_path, float(min_len)
+
+
+SOLVERS = {
+    'held_karp': held_karp,
+    'branch_and_bound': branch_and_bound,
+}
+SOLVER_MAX_SIZES = {
+    'held_karp': HELD_KARP_MAX_SIZE,
+    'branch_and_bound': BRANCH_AND_BOUND_MAX_SIZE,
+}
+
+
+def check_size(point_num: int, solver: str = 'held_karp'):
+    """
+    checking whether a path of point_num points (including the start and the end) is within the limit of solver
+    :param point_num: int, the number of points in the path
+    :param solver: string, the name of solver: held_karp or branch_and_bound
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown path solver: {solver}, the options are {list(SOLVERS.keys())}")
+    if point_num > SOLVER_MAX_SIZES[solver]:
+        raise ValueError(f"The path solver {solver} supports at most {SOLVER_MAX_SIZES[solver]} points, "
+                         f"but got {point_num}")
+
+
+def solve(dist_adj: np.ndarray, solver: str = 'held_karp') -> tuple[list, float]:
+    """
+    finding the shortest Hamiltonian path with fixed start and end by the selected exact solver
+    :param dist_adj: numpy array, the distance matrix of all points in the path
+    :param solver: string, the name of solver: held_karp or branch_and_bound
+    """
+    check_size(len(dist_adj), solver)
+    return SOLVERS[solver](dist_adj)
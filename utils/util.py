@@ -1,4 +1,5 @@
 # -*- coding: UTF-8 -*-
+import math as m
 import numpy as np
 
 
@@ -29,7 +30,18 @@ def int_to_binary(val, qubit_num):
 
 
 def cal_similarity(point1, point2):
-    return np.linalg.norm(np.array(point1) - np.array(point2))
+    return m.hypot(point1[0] - point2[0], point1[1] - point2[1])
+
+
+def cal_dist_matrix(points) -> np.ndarray:
+    """
+    calculating the Euclidean distance between every pair of points at once
+    :param points: list or numpy array with the shape of (n, 2)
+    :return: numpy array with the shape of (n, n)
+    """
+    coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    diff = coords[:, np.newaxis, :] - coords[np.newaxis, :, :]
+    return np.sqrt((diff ** 2).sum(axis=-1))
 
 
 def find_optimal_path(points, cur_path, cur_len, opt_path, min_len, is_chosen):